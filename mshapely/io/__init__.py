@@ -1,2 +1,4 @@
 from .tonumpy import *
-from .gis import GIS
\ No newline at end of file
+from .gis import GIS
+from .npz import saveNpz,loadNpz
+from .columnar import ColumnarGeometry,ColumnarProperties,saveColumnar,loadColumnar
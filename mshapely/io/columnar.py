@@ -0,0 +1,324 @@
+import json
+import numpy as np
+from shapely.geometry import Point,LineString,Polygon,MultiPoint,MultiLineString,MultiPolygon,GeometryCollection
+from shapely.geometry.base import BaseGeometry
+
+from .npz import saveNpz,loadNpz
+
+TYPES=["Point","LineString","Polygon","MultiPoint","MultiLineString","MultiPolygon"]
+# Point, line or polygon family of every type
+FAMILY=np.array([0,1,2,0,1,2])
+
+def toColumnar(geometries):
+  """
+  Converts geometries to flat arrays
+
+  Parameters
+  ----------
+  geometries:list[Point,LineString,Polygon,MultiPoint,MultiLineString,MultiPolygon]
+    Shapely geometries or GeoJSON-like mappings (i.e. features read by fiona)
+
+  Output
+  ------
+  dict
+    types:1D ndarray(int8), index in TYPES
+    geometryOffsets:1D ndarray, parts of geometry i are geometryOffsets[i]:geometryOffsets[i+1]
+    partOffsets:1D ndarray, rings of part j are partOffsets[j]:partOffsets[j+1]
+    ringOffsets:1D ndarray, coordinates of ring k are ringOffsets[k]:ringOffsets[k+1]
+    coords:2D ndarray(float64) : [[x,y]]
+
+  Note
+  ----
+  Points and LineStrings have one ring per part. Polygons have the exterior followed by the interiors.
+  """
+  types,nparts,nrings,ncoords,coords=[],[],[],[],[]
+  for geometry in geometries:
+    name,parts=_parts(geometry)
+    types.append(TYPES.index(name))
+    nparts.append(len(parts))
+    for rings in parts:
+      nrings.append(len(rings))
+      for ring in rings:
+        xy=np.asarray(ring,dtype=np.float64)
+        xy=xy[:,:2] if xy.ndim==2 else np.zeros((0,2))
+        ncoords.append(len(xy))
+        coords.append(xy)
+
+  offsets=lambda counts:np.concatenate(([0],np.cumsum(counts,dtype=np.int64)))
+  return dict(
+    types=np.array(types,dtype=np.int8),
+    geometryOffsets=offsets(nparts),
+    partOffsets=offsets(nrings),
+    ringOffsets=offsets(ncoords),
+    coords=np.concatenate(coords) if coords else np.zeros((0,2)),
+  )
+
+def _parts(geometry):
+  """
+  Type and coordinates of the rings of every part of a shapely geometry or a GeoJSON-like mapping
+  """
+  if isinstance(geometry,BaseGeometry):
+    name=geometry.type
+    if name not in TYPES:raise Exception("{} is not supported".format(name))
+    parts=list(geometry.geoms) if name.startswith("Multi") else ([] if geometry.is_empty else [geometry])
+    return name,[[part.exterior.coords,*[ring.coords for ring in part.interiors]] if isinstance(part,Polygon) else [part.coords] for part in parts]
+  
+  geometry=getattr(geometry,'__geo_interface__',geometry)
+  name,coordinates=geometry['type'],geometry['coordinates']
+  if name not in TYPES:raise Exception("{} is not supported".format(name))
+  if len(coordinates)==0:return name,[]
+  if name=="Point":return name,[[[coordinates]]]
+  if name=="LineString":return name,[[coordinates]]
+  if name=="Polygon":return name,[coordinates]
+  if name=="MultiPoint":return name,[[[point]] for point in coordinates]
+  if name=="MultiLineString":return name,[[line] for line in coordinates]
+  return name,coordinates
+
+def _propertyColumns(properties):
+  """
+  Columns of the attribute table. Missing values (None) are saved in a "null:" mask.
+  """
+  properties=list(properties)
+  names=list(dict.fromkeys(name for property in properties for name in property))
+  columns={}
+  for name in names:
+    values=[property.get(name) for property in properties]
+    null=np.array([value is None for value in values])
+    valid=[value for value in values if value is not None]
+    if all(isinstance(value,(bool,np.bool_)) for value in valid):dtype=bool
+    elif all(isinstance(value,(int,np.integer)) for value in valid):dtype=np.int64
+    elif all(isinstance(value,(int,float,np.integer,np.floating)) for value in valid):dtype=np.float64
+    else:dtype=str
+    fill=dtype() if dtype is not str else ""
+    columns["property:"+name]=np.array([fill if value is None else value for value in values],dtype=dtype)
+    if np.any(null):columns["null:"+name]=null
+  return columns
+
+def saveColumnar(path,geometries,properties=None,schema=None):
+  """
+  Save geometries and properties to a columnar file (uncompressed npz, see saveNpz)
+
+  Parameters
+  ----------
+  path:str
+  geometries:list
+  properties:list[dict],optional
+  schema:dict,optional
+  """
+  saveNpz(path,**toArrays(geometries,properties,schema))
+
+def loadColumnar(path,mmap_mode='r'):
+  """
+  Load a columnar file. Arrays are memory-mapped, geometries and properties are created on access.
+
+  Output
+  ------
+  geometry:ColumnarGeometry
+  properties:ColumnarProperties
+  schema:dict
+  """
+  return fromArrays(loadNpz(path,mmap_mode))
+
+def toArrays(geometries,properties=None,schema=None):
+  """
+  Columnar arrays of geometries, properties and schema (see saveColumnar)
+
+  Output
+  ------
+  dict:{name:ndarray}
+  """
+  arrays=toColumnar(geometries)
+  if properties is not None:arrays.update(_propertyColumns(properties))
+  arrays['schema']=np.frombuffer(json.dumps(schema or {}).encode(),dtype=np.uint8)
+  return arrays
+
+def fromArrays(arrays):
+  """
+  Geometry, properties and schema of columnar arrays (see toArrays). Arrays are not copied.
+
+  Output
+  ------
+  geometry:ColumnarGeometry
+  properties:ColumnarProperties
+  schema:dict
+  """
+  schema=json.loads(bytes(arrays['schema']).decode())
+  columns={name[9:]:array for name,array in arrays.items() if name.startswith("property:")}
+  nulls={name[5:]:array for name,array in arrays.items() if name.startswith("null:")}
+  geometry=ColumnarGeometry(**{key:arrays[key] for key in ["types","geometryOffsets","partOffsets","ringOffsets","coords"]})
+  return geometry,ColumnarProperties(columns,nulls,len(geometry)),schema
+
+def mergeArrays(arrays,schema=None):
+  """
+  Concatenate columnar arrays (see toArrays), in order.
+  Offsets are shifted, properties missing in some arrays are null.
+
+  Parameters
+  ----------
+  arrays:list[dict]
+  schema:dict,optional
+    Schema of the merged arrays. Default is the schema of the first arrays.
+
+  Output
+  ------
+  dict:{name:ndarray}
+  """
+  merged={}
+  for key,count in [("geometryOffsets","partOffsets"),("partOffsets","ringOffsets"),("ringOffsets","coords")]:
+    shifts=np.cumsum([0]+[len(a[count])-(count!="coords") for a in arrays[:-1]])
+    merged[key]=np.concatenate([[0]]+[a[key][1:]+shift for a,shift in zip(arrays,shifts)]).astype(np.int64)
+  merged['types']=np.concatenate([a['types'] for a in arrays]).astype(np.int8)
+  merged['coords']=np.concatenate([np.asarray(a['coords']).reshape(-1,2) for a in arrays])
+
+  names=list(dict.fromkeys(name[9:] for a in arrays for name in a if name.startswith("property:")))
+  for name in names:
+    columns=[a.get("property:"+name) for a in arrays]
+    if any(c is not None and c.dtype.kind=='U' for c in columns):dtype=str
+    else:dtype=np.result_type(*[c.dtype for c in columns if c is not None]).type
+    fill=dtype() if dtype is not str else ""
+    merged["property:"+name]=np.concatenate([np.full(len(a['types']),fill,dtype=dtype) if c is None else np.asarray(c).astype(dtype) for a,c in zip(arrays,columns)])
+    null=np.concatenate([np.ones(len(a['types']),dtype=bool) if c is None else np.asarray(a.get("null:"+name,np.zeros(len(a['types']),dtype=bool))) for a,c in zip(arrays,columns)])
+    if np.any(null):merged["null:"+name]=null
+
+  if schema is None:schema=json.loads(bytes(arrays[0]['schema']).decode()) if arrays else {}
+  merged['schema']=np.frombuffer(json.dumps(schema).encode(),dtype=np.uint8)
+  return merged
+
+class ColumnarProperties(object):
+  """
+  Attribute table, rows are dict created on access
+  """
+  def __init__(self,columns,nulls,n):
+    self.columns=columns
+    self.nulls=nulls
+    self.n=n
+
+  def __len__(self):
+    return self.n
+
+  def __getitem__(self,i):
+    if i<0:i+=self.n
+    if i<0 or i>=self.n:raise IndexError(i)
+    return {name:None if name in self.nulls and self.nulls[name][i] else column[i].item() for name,column in self.columns.items()}
+
+  def __iter__(self):
+    for i in range(self.n):yield self[i]
+
+  def column(self,name):
+    """
+    Values of a property (memory-mapped array)
+    """
+    return self.columns[name]
+
+class ColumnarGeometry(object):
+  """
+  Collection of geometries saved in flat arrays (see toColumnar).
+  Shapely geometries are only created on access, xy and np are computed from the arrays.
+  """
+  type="GeometryCollection"
+
+  def __init__(self,types,geometryOffsets,partOffsets,ringOffsets,coords):
+    self.types=types
+    self.geometryOffsets=geometryOffsets
+    self.partOffsets=partOffsets
+    self.ringOffsets=ringOffsets
+    self.coords=coords
+
+  @staticmethod
+  def fromGeometries(geometries):
+    return ColumnarGeometry(**toColumnar(geometries))
+
+  def __len__(self):
+    return len(self.types)
+
+  @property
+  def is_empty(self):
+    return len(self.types)==0
+
+  @property
+  def geoms(self):
+    return self
+
+  def _ring(self,k):
+    return np.asarray(self.coords[self.ringOffsets[k]:self.ringOffsets[k+1]])
+
+  def _part(self,family,j):
+    rings=[self._ring(k) for k in range(self.partOffsets[j],self.partOffsets[j+1])]
+    if family==0:return Point(rings[0][0])
+    if family==1:return LineString(rings[0])
+    return Polygon(rings[0],rings[1:])
+
+  def __getitem__(self,i):
+    if i<0:i+=len(self)
+    if i<0 or i>=len(self):raise IndexError(i)
+    name=TYPES[self.types[i]]
+    family=FAMILY[self.types[i]]
+    parts=[self._part(family,j) for j in range(self.geometryOffsets[i],self.geometryOffsets[i+1])]
+    if name=="Point":return parts[0] if parts else Point()
+    if name=="LineString":return parts[0] if parts else LineString()
+    if name=="Polygon":return parts[0] if parts else Polygon()
+    return dict(MultiPoint=MultiPoint,MultiLineString=MultiLineString,MultiPolygon=MultiPolygon)[name](parts)
+
+  def __iter__(self):
+    for i in range(len(self)):yield self[i]
+
+  def toShape(self):
+    return GeometryCollection(list(self)).toShape()
+
+  def bounds(self):
+    """
+    Bounds of every geometry, [[minx,miny,maxx,maxy]]. Empty geometries are nan.
+    """
+    start=self.partOffsets[self.geometryOffsets[:-1]]
+    start=self.ringOffsets[start]
+    end=self.ringOffsets[self.partOffsets[self.geometryOffsets[1:]]]
+    bounds=np.full((len(self),4),np.nan)
+    valid=end>start
+    if np.any(valid):
+      coords=np.asarray(self.coords)
+      bounds[valid,:2]=np.minimum.reduceat(coords,start[valid],axis=0)
+      bounds[valid,2:]=np.maximum.reduceat(coords,start[valid],axis=0)
+    return bounds
+
+  def _family(self):
+    families=np.unique(FAMILY[np.asarray(self.types)])
+    return families[0] if len(families)==1 else None
+
+  @property
+  def xy(self):
+    """
+    xy coordinates of all geometries (memory-mapped array), same as GeometryCollection.xy
+    """
+    if self._family() is None:return self.toShape().xy
+    return self.coords
+
+  @property
+  def np(self):
+    """
+    Same array as GeometryCollection.np, computed from the offsets
+    """
+    family=self._family()
+    if family is None:return self.toShape().np
+    coords=np.asarray(self.coords)
+    if family==0:return coords
+
+    nparts=len(self.partOffsets)-1
+    ringCounts=np.diff(self.ringOffsets)
+    ringStart=np.repeat(self.ringOffsets[:-1],ringCounts)
+    ring=np.repeat(np.arange(len(ringCounts)),ringCounts)
+    ids=np.arange(len(coords))-ringStart
+
+    # Closed rings, the last point id is 0
+    last=self.ringOffsets[1:][ringCounts>1]-1
+    first=self.ringOffsets[:-1][ringCounts>1]
+    closed=np.all(coords[first]==coords[last],axis=1)
+    ids[last[closed]]=0
+
+    part=np.repeat(np.arange(nparts),np.diff(self.partOffsets))[ring]
+    if family==1:
+      if nparts==1:return np.column_stack((ids,coords))
+      return np.column_stack((part,ids,coords))
+
+    lid=ring-self.partOffsets[:-1][part]
+    if nparts==1:return np.column_stack((lid,ids,coords))
+    return np.column_stack((part,lid,ids,coords))
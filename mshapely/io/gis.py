@@ -1,9 +1,15 @@
 import os
 import sys
+import gzip
 import fiona
 import json
+import numpy as np
 from shapely.geometry import mapping, shape,GeometryCollection
-from geojson import Feature, FeatureCollection, dump
+from shapely.geometry.base import BaseGeometry
+
+from .columnar import ColumnarGeometry,saveColumnar,loadColumnar,toArrays,fromArrays,mergeArrays
+from .npz import loadNpz
+from ..misc import getExecutor
 
 
 class GIS(object):
@@ -23,28 +29,170 @@ class GIS(object):
     return [dict(id=i) for i, f in enumerate(geometry)]
 
 
-  def write(self,path):
+  def write(self,path,**kwargs):
     """
-    Write GIS file
+    Write GIS file (shapefile, geojson, geojson.gz or columnar mshp)
     """
-    ext=os.path.splitext(path)[1]
-    if ext == '.shp': return self.writeShapefile(path)
-    if ext == '.geojson':return self.writeGeoJSON(path)
+    ext=GIS._ext(path)
+    if ext == '.shp': return self.writeShapefile(path,**kwargs)
+    if ext in ['.geojson','.geojson.gz']:return self.writeGeoJSON(path,**kwargs)
+    if ext == '.mshp': return self.writeColumnar(path,**kwargs)
     
     raise Exception("Method does not exist{}".format(ext))
   
   @staticmethod
-  def read(path):
+  def _ext(path):
+    """
+    File extension, including .gz (i.e. .geojson.gz)
+    """
+    name,ext=os.path.splitext(path)
+    if ext==".gz":ext=os.path.splitext(name)[1]+ext
+    return ext
+  
+  @staticmethod
+  def _open(path,mode='r'):
+    """
+    Open text file, gzip compressed if the extension is .gz
+    """
+    if path.endswith(".gz"):return gzip.open(path,mode+'t')
+    return open(path,mode)
+  
+  @staticmethod
+  def read(path,**kwargs):
     """
     Read GIS file
+    
+    Parameters
+    ----------
+    path:str
+    bbox:(minx,miny,maxx,maxy),optional
+      Only features with a bounding box intersecting bbox
+    mask:shapely geometry,optional
+      Only features intersecting mask
+    where:dict,callable or str,optional
+      Property filter. dict of {name:value or list of values}, callable(properties)->bool,
+      or an OGR SQL where clause (shapefile only)
+    
+    Note
+    ----
+    Filters are applied before the features are converted to shapely geometries.
+    Shapefiles use fiona filtered iteration (spatial index if available). GeoJSON features
+    are checked against the bounding box of their raw coordinates.
+    Columnar (mshp) files are memory-mapped and read lazily (see readColumnar).
     """
     if not os.path.exists(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))  
-    ext = os.path.splitext(path)[1]
-    if ext==".shp":return GIS.readShapefile(path)
-    if ext==".geojson":return GIS.readGeoJSON(path)
+    ext = GIS._ext(path)
+    if ext==".shp":return GIS.readShapefile(path,**kwargs)
+    if ext in [".geojson",".geojson.gz"]:return GIS.readGeoJSON(path,**kwargs)
+    if ext==".mshp":return GIS.readColumnar(path,**kwargs)
     
     raise Exception("Method does not exist{}".format(ext))
   
+  @staticmethod
+  def readMany(paths,workers=None,executor=None,source="source",**kwargs):
+    """
+    Read and merge GIS files (i.e. tiled shapefiles), using a process pool
+    
+    Parameters
+    ----------
+    paths:list[str]
+    workers:int,optional
+      Number of processes. None or 1 reads serially, -1 uses all cpus.
+    executor:concurrent.futures.Executor,optional
+      User executor, it is not shut down
+    source:str,optional
+      Name of the property with the path of the file of every feature. None doesn't add it.
+    kwargs:
+      Filters (see read), applied to every file
+    
+    Output
+    ------
+    GIS with a ColumnarGeometry, features are in the order of paths and of every file.
+    
+    Note
+    ----
+    Workers convert the raw coordinates of the features to columnar arrays (flat coordinates, offsets and
+    property columns, see io.columnar), without creating shapely geometries.
+    The arrays are transferred as contiguous buffers instead of pickled shapely geometries.
+    The schema is the schema of the first file, with the properties of all files.
+    """
+    paths=[str(path) for path in paths]
+    if len(paths)==0:raise Exception("No files to read")
+    for path in paths:
+      if not os.path.exists(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))
+    
+    with getExecutor(workers if len(paths)>1 else None,executor,process=True) as pool:
+      if pool is None:results=[_readArrays(path,kwargs) for path in paths]
+      else:results=list(pool.map(_readArrays,paths,[kwargs]*len(paths)))
+    
+    schemas=[fromArrays(arrays)[2] for arrays in results]
+    schema=dict(schemas[0])
+    schema['properties']={k:v for s in schemas for k,v in s.get('properties',{}).items()}
+    if source is not None:schema['properties'][source]='str'
+    arrays=mergeArrays(results,schema)
+    if source is not None:arrays["property:"+source]=np.repeat(paths,[len(a['types']) for a in results])
+    geometry,properties,schema=fromArrays(arrays)
+    return GIS(geometry,properties,schema)
+  
+  @staticmethod
+  def iter(path,chunkSize=1000,bbox=None,mask=None,where=None):
+    """
+    Iterate over the features of a GIS file in one pass, without loading the whole file
+    
+    Parameters
+    ----------
+    path:str
+    chunkSize:int
+      Number of features per batch
+    bbox,mask,where:
+      Filters (see read)
+    
+    Output
+    ------
+    generator of (geometries:list[shapely geometry], properties:list[dict])
+    """
+    if not os.path.exists(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))
+    return GIS._iter(path,chunkSize,{},bbox,mask,where)
+  
+  @staticmethod
+  def _iter(path,chunkSize,meta,bbox=None,mask=None,where=None,raw=False):
+    """
+    Batches of features, meta["schema"] is set once it is read.
+    If raw, geometries are not converted to shapely (GeoJSON-like mappings), unless a mask is used.
+    """
+    if bbox is not None and mask is not None:raise Exception("bbox and mask are mutually exclusive")
+    ext = GIS._ext(path)
+    if ext==".shp":features=GIS._iterShapefile(path,meta,bbox,mask,where if isinstance(where,str) else None)
+    elif ext in [".geojson",".geojson.gz"]:
+      if isinstance(where,str):raise Exception("SQL where clause is only available for shapefiles")
+      features=GIS._iterGeoJSON(path,meta,bbox=bbox if mask is None else mask.bounds)
+    elif ext==".mshp":
+      if isinstance(where,str):raise Exception("SQL where clause is only available for shapefiles")
+      features=GIS._iterColumnar(path,meta,bbox=bbox if mask is None else mask.bounds)
+    else:raise Exception("Method does not exist{}".format(ext))
+    
+    match=_whereFunction(where)
+    geometries,properties=[],[]
+    for geometry,property in features:
+      if match is not None and not match(property):continue
+      if not isinstance(geometry,BaseGeometry) and (not raw or mask is not None):geometry=shape(geometry)
+      if mask is not None and not geometry.intersects(mask):continue
+      geometries.append(geometry)
+      properties.append(property)
+      if len(geometries)==chunkSize:
+        yield geometries,properties
+        geometries,properties=[],[]
+    if geometries:yield geometries,properties
+  
+  @staticmethod
+  def _readAll(path,**kwargs):
+    meta={}
+    geometries,properties=[],[]
+    for _geometries,_properties in GIS._iter(path,10000,meta,**kwargs):
+      geometries.extend(_geometries)
+      properties.extend(_properties)
+    return GIS(GeometryCollection(geometries),properties,meta.get("schema",{}))
+  
   @staticmethod
   def delete(path): 
     """
@@ -57,69 +205,272 @@ class GIS(object):
         os.remove(name+".shx")
         os.remove(name+".dbf")
         os.remove(name+".cpg")
-      elif ext==".geojson":
+      elif GIS._ext(path) in [".geojson",".geojson.gz",".mshp"]:
         os.remove(path)
 
   @staticmethod
   def _cgeometry(geometry):
-    geometry= geometry if isinstance(geometry, (list,GeometryCollection)) else [geometry]
+    geometry= geometry if isinstance(geometry, (list,GeometryCollection,ColumnarGeometry)) else [geometry]
     return geometry
     
-  def writeShapefile(self,path):
+  def _features(self,precision=None):
+    """
+    GeoJSON-like geometry and properties of every feature
     """
-    Write to shapefile
-    """    
-    schema=self.schema
     geometry = self._cgeometry(self.geometry)
-    properties = self.properties
-    with fiona.collection(path, "w", "ESRI Shapefile", schema) as shapefile:
-      for geometry, property in zip(geometry, properties):
-        shapefile.write({'geometry': mapping(geometry),
-                         'properties': property
-                         })
-    
-  def writeGeoJSON(self,path):
+    for geo, property in zip(geometry, self.properties):
+      geo=mapping(geo)
+      if precision is not None:geo=_roundGeometry(geo,precision)
+      yield geo,property
+  
+  def writeShapefile(self,path,chunkSize=10000):
     """
-    Write to geojson
+    Write to shapefile, chunkSize features at a time (writerecords)
     """    
     schema=self.schema
-    geometry = self._cgeometry(self.geometry)
+    with fiona.collection(path, "w", "ESRI Shapefile", schema) as shapefile:
+      records=[]
+      for geometry, property in self._features():
+        records.append({'geometry': geometry,'properties': property})
+        if len(records)==chunkSize:
+          shapefile.writerecords(records)
+          records=[]
+      if records:shapefile.writerecords(records)
     
-    properties = self.properties
+  def writeGeoJSON(self,path,precision=6,chunkSize=10000):
+    """
+    Write to geojson (or geojson.gz), features are encoded and written chunkSize at a time.
     
-    features = []
-    features = [Feature(geometry=geo, properties=property) for geo, property in zip(geometry, properties)]
-      
-    with open(path, 'w') as f:
-      collection=FeatureCollection(features)
-      collection['schema']=schema
-      dump(collection, f)
+    Parameters
+    ----------
+    path:str
+    precision:int,optional
+      Number of decimals of the coordinates. None keeps all digits.
+      Default is 6, similar to the geojson package.
+    chunkSize:int
+    """    
+    with GIS._open(path, 'w') as f:
+      f.write('{"type": "FeatureCollection", "features": [')
+      chunk=[]
+      first=True
+      for geometry, property in self._features(precision):
+        chunk.append(json.dumps({"type": "Feature", "geometry": geometry, "properties": property}))
+        if len(chunk)==chunkSize:
+          f.write(("" if first else ", ")+", ".join(chunk))
+          chunk=[]
+          first=False
+      if chunk:f.write(("" if first else ", ")+", ".join(chunk))
+      f.write('], "schema": {}}}'.format(json.dumps(self.schema)))
+  
+  def writeColumnar(self,path):
+    """
+    Write to columnar file (mshp): flat coordinates, offsets and property columns (see io.columnar).
+    The file can be memory-mapped with readColumnar.
+    """
+    saveColumnar(path,self._cgeometry(self.geometry),self.properties,self.schema)
  
   @staticmethod
-  def readShapefile(path):
+  def readShapefile(path,**kwargs):
     """
-    Read shapefile
+    Read shapefile (see read for filters)
     """       
     # Get Feature/Geometry in memory for Shapely.
     if not os.path.isfile(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))
-    
-    with fiona.collection(path, 'r') as input:
-      geometry = GeometryCollection([shape(shp['geometry']) for shp in input])  # Save geometry
-      properties = [shp['properties'] for shp in input]  # Save properties
-      return GIS(geometry,properties,input.schema.copy())
+    return GIS._readAll(path,**kwargs)
   
   @staticmethod
-  def readGeoJSON(path):
+  def readGeoJSON(path,**kwargs):
     """
-    Read geojson
+    Read geojson (see read for filters)
     """     
     if not os.path.isfile(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))
-    
-    with open(path) as f:
-      collection=json.load(f)
-      schema = collection.get("schema",{})
-      features = collection["features"]
-      geometry = GeometryCollection([shape(feature["geometry"]) for feature in features])
-      properties = [feature['properties'] for feature in features]  # Save properties
-      return GIS(geometry,properties,schema)
-    
\ No newline at end of file
+    return GIS._readAll(path,**kwargs)
+  
+  @staticmethod
+  def readColumnar(path,mmap_mode='r',**kwargs):
+    """
+    Read columnar file (mshp).
+    Without filters, arrays are memory-mapped and the geometry is a ColumnarGeometry:
+    xy and np are computed from the mapped coordinates, shapely geometries are only created on access.
+    With filters (see read), the features are read as shapely geometries.
+    """
+    if not os.path.isfile(path):raise Exception("File {0} does not exist".format(os.path.abspath(path)))
+    if any(value is not None for value in kwargs.values()):return GIS._readAll(path,**kwargs)
+    geometry,properties,schema=loadColumnar(path,mmap_mode)
+    return GIS(geometry,properties,schema)
+  
+  @staticmethod
+  def _iterShapefile(path,meta,bbox=None,mask=None,where=None):
+    """
+    Geometry and properties of every feature, in one pass over the collection.
+    Filters are passed to fiona.
+    """
+    filters={}
+    if bbox is not None:filters['bbox']=tuple(bbox)
+    if mask is not None:filters['mask']=mapping(mask)
+    if where is not None:filters['where']=where
+    with fiona.collection(path, 'r') as input:
+      meta['schema']=input.schema.copy()
+      for shp in (input.filter(**filters) if filters else input):
+        yield shp['geometry'],shp['properties']
+  
+  @staticmethod
+  def _iterGeoJSON(path,meta,blockSize=1<<20,bbox=None):
+    """
+    Geometry and properties of every feature, parsed incrementally (json.JSONDecoder.raw_decode).
+    Other members of the FeatureCollection (i.e. schema) are saved in meta.
+    Features with raw coordinates outside bbox are skipped.
+    """
+    with GIS._open(path) as f:
+      reader=_JSONReader(f,blockSize)
+      reader.expect("{")
+      while not reader.next("}"):
+        key=reader.value()
+        reader.expect(":")
+        if key!="features":
+          meta[key]=reader.value()
+        else:
+          reader.expect("[")
+          while not reader.next("]"):
+            feature=reader.value()
+            if bbox is None or _intersectsBounds(_geometryBounds(feature["geometry"]),bbox):
+              yield feature["geometry"],feature["properties"]
+            reader.next(",")
+        reader.next(",")
+  
+  @staticmethod
+  def _iterColumnar(path,meta,bbox=None):
+    """
+    Geometry and properties of every feature of a columnar file.
+    Features outside bbox are skipped using the bounds of the mapped coordinates.
+    """
+    geometry,properties,meta['schema']=loadColumnar(path)
+    indices=range(len(geometry))
+    if bbox is not None:
+      bounds=geometry.bounds()
+      minx,miny,maxx,maxy=bbox
+      indices=np.flatnonzero((bounds[:,0]<=maxx)&(bounds[:,2]>=minx)&(bounds[:,1]<=maxy)&(bounds[:,3]>=miny))
+    for i in indices:
+      yield geometry[i],properties[i]
+
+
+def _readArrays(path,kwargs):
+  """
+  Columnar arrays of all features of a file (see GIS.readMany)
+  """
+  if GIS._ext(path)==".mshp" and all(value is None for value in kwargs.values()):
+    return loadNpz(path,None)
+  meta={}
+  geometries,properties=[],[]
+  for _geometries,_properties in GIS._iter(path,10000,meta,raw=True,**kwargs):
+    geometries.extend(_geometries)
+    properties.extend(_properties)
+  return toArrays(geometries,properties,meta.get("schema",{}))
+
+def _roundGeometry(geometry,precision):
+  """
+  Round coordinates of a GeoJSON-like geometry
+  """
+  if geometry["type"]=="GeometryCollection":
+    return dict(type=geometry["type"],geometries=[_roundGeometry(g,precision) for g in geometry["geometries"]])
+  return dict(type=geometry["type"],coordinates=_roundCoordinates(geometry["coordinates"],precision))
+
+def _roundCoordinates(coordinates,precision):
+  if len(coordinates)==0:return []
+  if not isinstance(coordinates[0],(list,tuple)):return np.round(np.asarray(coordinates,dtype=np.float64),precision).tolist()
+  if not isinstance(coordinates[0][0],(list,tuple)):return np.round(np.asarray(coordinates,dtype=np.float64),precision).tolist()
+  return [_roundCoordinates(c,precision) for c in coordinates]
+
+def _whereFunction(where):
+  """
+  Property filter function of a dict (or callable)
+  """
+  if where is None or isinstance(where,str):return None
+  if callable(where):return where
+  if not isinstance(where,dict):raise Exception("where needs to be a dict, a callable or a str")
+  where={key:value if isinstance(value,(list,tuple,set)) else [value] for key,value in where.items()}
+  return lambda properties:all(properties.get(key) in values for key,values in where.items())
+
+def _geometryBounds(geometry):
+  """
+  Bounds of a GeoJSON geometry from its raw coordinates, None if empty
+  """
+  if geometry is None:return None
+  if geometry.get("type")=="GeometryCollection":
+    bounds=[b for b in map(_geometryBounds,geometry["geometries"]) if b is not None]
+  else:
+    bounds=[b for b in _coordinatesBounds(geometry.get("coordinates",[])) if b is not None]
+  if not bounds:return None
+  bounds=np.array(bounds)
+  return (*np.min(bounds[:,:2],axis=0),*np.max(bounds[:,2:],axis=0))
+
+def _coordinatesBounds(coordinates):
+  """
+  Bounds of every list of positions in nested GeoJSON coordinates
+  """
+  if len(coordinates)==0:return [None]
+  if not isinstance(coordinates[0],list):coordinates=[coordinates]
+  if not isinstance(coordinates[0][0],list):
+    xy=np.array(coordinates,dtype=np.float64)[:,:2]
+    return [(*np.min(xy,axis=0),*np.max(xy,axis=0))]
+  return [b for c in coordinates for b in _coordinatesBounds(c)]
+
+def _intersectsBounds(a,b):
+  if a is None:return False
+  return a[0]<=b[2] and a[2]>=b[0] and a[1]<=b[3] and a[3]>=b[1]
+
+class _JSONReader(object):
+  """
+  Incremental JSON tokenizer over a text file
+  """
+  def __init__(self,file,blockSize=1<<20):
+    self.file=file
+    self.blockSize=blockSize
+    self.buffer=""
+    self.pos=0
+    self.eof=False
+    self.decoder=json.JSONDecoder()
+  
+  def fill(self,size=None):
+    block=self.file.read(size or self.blockSize)
+    if not block:self.eof=True
+    self.buffer=self.buffer[self.pos:]+block
+    self.pos=0
+  
+  def skip(self):
+    """
+    Skip whitespace, returns the next character or None at the end of the file
+    """
+    while True:
+      while self.pos<len(self.buffer) and self.buffer[self.pos].isspace():self.pos+=1
+      if self.pos<len(self.buffer):return self.buffer[self.pos]
+      if self.eof:return None
+      self.fill()
+  
+  def next(self,char):
+    """
+    Consume char if it is the next character
+    """
+    if self.skip()!=char:return False
+    self.pos+=1
+    return True
+  
+  def expect(self,char):
+    if not self.next(char):raise Exception("Invalid GeoJSON, expected '{}'".format(char))
+  
+  def value(self):
+    """
+    Decode the next JSON value, reading more of the file until it is complete
+    """
+    size=self.blockSize
+    while True:
+      self.skip()
+      try:
+        value,end=self.decoder.raw_decode(self.buffer,self.pos)
+        if end<len(self.buffer) or self.eof:
+          self.pos=end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:raise
+      self.fill(size)
+      size*=2
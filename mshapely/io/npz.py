@@ -0,0 +1,68 @@
+import struct
+import zipfile
+import numpy as np
+
+def saveNpz(path,**arrays):
+  """
+  Save arrays to an uncompressed npz file.
+  Uncompressed members can be memory-mapped with loadNpz.
+
+  Parameters
+  ----------
+  path: str
+  arrays: ndarray
+  """
+  with open(path,'wb') as f:
+    np.savez(f,**arrays)
+
+def loadNpz(path,mmap_mode='r'):
+  """
+  Load npz file.
+
+  Parameters
+  ----------
+  path: str
+  mmap_mode: str,optional
+    Memory-map mode (see np.memmap). None reads arrays in memory.
+
+  Output
+  ------
+  dict: {name:ndarray}
+
+  Note
+  ----
+  np.load ignores mmap_mode for npz files.
+  Stored (uncompressed) members are memory-mapped directly from their offset in the zip file.
+  Compressed, empty and object members are read in memory.
+  """
+  arrays={}
+  with zipfile.ZipFile(path) as archive, open(path,'rb') as f:
+    for info in archive.infolist():
+      name=info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+      array=None
+      if mmap_mode is not None and info.compress_type==zipfile.ZIP_STORED:
+        array=_mmapMember(f,info,path,mmap_mode)
+      if array is None:
+        with archive.open(info) as member:
+          array=np.lib.format.read_array(member,allow_pickle=False)
+      arrays[name]=array
+  return arrays
+
+def _mmapMember(f,info,path,mmap_mode):
+  """
+  Memory-map a stored npy member. Returns None if it can't be memory-mapped.
+  """
+  # Local file header is 30 bytes, followed by the file name and extra field
+  f.seek(info.header_offset)
+  header=f.read(30)
+  nameLength,extraLength=struct.unpack('<HH',header[26:30])
+  f.seek(info.header_offset+30+nameLength+extraLength)
+
+  version=np.lib.format.read_magic(f)
+  if version==(1,0):shape,fortran,dtype=np.lib.format.read_array_header_1_0(f)
+  elif version==(2,0):shape,fortran,dtype=np.lib.format.read_array_header_2_0(f)
+  else:return None
+  if dtype.hasobject or int(np.prod(shape))==0:return None
+
+  order='F' if fortran else 'C'
+  return np.memmap(path,dtype=dtype,mode=mmap_mode,offset=f.tell(),shape=shape,order=order)
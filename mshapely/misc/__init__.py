@@ -1 +1,3 @@
-from .func import *
\ No newline at end of file
+from .func import *
+from .neighbour import *
+from .parallel import *
\ No newline at end of file
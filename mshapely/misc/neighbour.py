@@ -0,0 +1,312 @@
+from itertools import chain
+import numpy as np
+from scipy import spatial
+
+def ll2csr(l):
+  """
+  Converts kdtree list of lists to flat (CSR) arrays
+
+  Parameters
+  ----------
+  l:list[list[int]]
+    List of lists of integers (i.e. cKDTree.query_ball_point)
+
+  Output
+  ------
+  indices:1D ndarray(int)
+    Neighbour indices of all rows, one after the other
+  offsets:1D ndarray(int), shape:(nrow+1)
+    Neighbours of row i are indices[offsets[i]:offsets[i+1]]
+
+  Note
+  ----
+  Unlike ll2numpy, memory scales with the total number of neighbours and not with the largest row.
+
+  Example
+  ------
+  >>> ll2csr([[0,1],[],[2]])
+  (array([0, 1, 2]), array([0, 2, 2, 3]))
+  """
+  lengths=np.fromiter(map(len,l),dtype=np.intp,count=len(l))
+  offsets=np.zeros(len(l)+1,dtype=np.intp)
+  np.cumsum(lengths,out=offsets[1:])
+  indices=np.fromiter(chain.from_iterable(l),dtype=np.intp,count=offsets[-1])
+  return indices,offsets
+
+def queryCSR(kdtree,points,r,**kwargs):
+  """
+  Search neighbours within distance r and returns CSR arrays.
+  See ll2csr.
+
+  Parameters
+  ----------
+  kdtree:cKDTree
+  points:2D ndarray : [[x,y]]
+  r:float or 1D ndarray
+    Search radius (per point if array)
+  """
+  return ll2csr(kdtree.query_ball_point(points,r,**kwargs))
+
+def csrRows(offsets):
+  """
+  Row number of every flat element
+  """
+  return np.repeat(np.arange(len(offsets)-1),np.diff(offsets))
+
+def segmentMin(values,offsets,empty=np.inf):
+  """
+  Minimum value of every row
+
+  Parameters
+  ----------
+  values:1D ndarray
+    Flat values, same length as CSR indices
+  offsets:1D ndarray(int)
+  empty:float
+    Value given to rows without neighbours
+  """
+  n=len(offsets)-1
+  results=np.full(n,empty,dtype=np.result_type(values,empty))
+  nonempty=offsets[1:]>offsets[:-1]
+  if np.any(nonempty):
+    results[nonempty]=np.minimum.reduceat(values,offsets[:-1][nonempty])
+  return results
+
+def segmentArgmin(values,offsets):
+  """
+  Flat position of the minimum value of every row.
+  Ties return the first position in the row, similar to np.argmin.
+  Rows without neighbours return -1.
+
+  Parameters
+  ----------
+  values:1D ndarray
+    Flat values, same length as CSR indices
+  offsets:1D ndarray(int)
+  """
+  n=len(offsets)-1
+  results=np.full(n,-1,dtype=np.intp)
+  nonempty=offsets[1:]>offsets[:-1]
+  if not np.any(nonempty):return results
+
+  mins=segmentMin(values,offsets)
+  nvalues=len(values)
+  positions=np.where(values==mins[csrRows(offsets)],np.arange(nvalues),nvalues)
+  results[nonempty]=np.minimum.reduceat(positions,offsets[:-1][nonempty])
+  return results
+
+class Index(object):
+  """
+  Dynamic spatial index
+  
+  It keeps a static cKDTree of the base points and a small cKDTree of the points appended since the last rebuild.
+  Removed points are masked instead of rebuilding the tree.
+  The index is rebuilt when appended or removed points exceed a ratio of the base points.
+  
+  Parameters
+  ----------
+  xy:2D ndarray : [[x,y]]
+  balanced_tree:bool
+    balanced_tree is a kdtree parameter
+  ratio:float
+    Rebuild threshold, fraction of the base points
+  tree:cKDTree,optional
+    Existing tree of xy (i.e. unpickled), avoids building the base tree
+  
+  Note
+  ----
+  Indices returned by query always refer to the current rows (i.e. after removals and appends),
+  sorted by row similar to a cKDTree built on the current points.
+  """
+  def __init__(self,xy,balanced_tree=True,ratio=0.25,tree=None):
+    self.balanced_tree=balanced_tree
+    self.ratio=ratio
+    self.rebuild(xy,tree)
+  
+  def __len__(self):
+    return len(self.xy)
+  
+  def rebuild(self,xy=None,tree=None):
+    """
+    Rebuild base tree with all current points
+    """
+    if xy is None:xy=self.xy
+    self.xy=np.asarray(xy)[:,:2]
+    self.tree=spatial.cKDTree(self.xy,balanced_tree=self.balanced_tree) if tree is None else tree
+    self.rows=np.arange(len(self.xy))
+    self.nremoved=0
+    self.delta=None
+    self.deltaRows=np.zeros(0,dtype=np.intp)
+    return self
+  
+  def append(self,xy):
+    """
+    Append points. New rows are added at the end.
+    """
+    xy=np.asarray(xy)[:,:2]
+    n=len(self.xy)
+    self.xy=np.concatenate((self.xy,xy))
+    self.deltaRows=np.concatenate((self.deltaRows,np.arange(n,len(self.xy))))
+    if len(self.deltaRows)>self.ratio*len(self.rows):return self.rebuild()
+    self.delta=spatial.cKDTree(self.xy[self.deltaRows],balanced_tree=self.balanced_tree)
+    return self
+  
+  def remove(self,keep):
+    """
+    Remove points
+    
+    Parameters
+    ----------
+    keep:1D ndarray(bool)
+      Mask of the current rows to keep
+    """
+    keep=np.asarray(keep,dtype=bool)
+    if np.all(keep):return self
+    remap=np.cumsum(keep)-1
+    remap[~keep]=-1
+    self.xy=self.xy[keep]
+    alive=self.rows>=0
+    self.nremoved+=np.count_nonzero(~keep[self.rows[alive]])
+    self.rows[alive]=remap[self.rows[alive]]
+    
+    self.deltaRows=remap[self.deltaRows]
+    deltaKeep=self.deltaRows>=0
+    if self.nremoved>self.ratio*len(self.rows):return self.rebuild()
+    if not np.all(deltaKeep):
+      self.deltaRows=self.deltaRows[deltaKeep]
+      self.delta=spatial.cKDTree(self.xy[self.deltaRows],balanced_tree=self.balanced_tree) if len(self.deltaRows) else None
+    return self
+  
+  def query(self,points,r,**kwargs):
+    """
+    Search neighbours within distance r and returns CSR arrays (see ll2csr).
+    
+    Parameters
+    ----------
+    points:2D ndarray : [[x,y]]
+    r:float or 1D ndarray
+      Search radius (per point if array)
+    kwargs:
+      Passed to cKDTree.query_ball_point (i.e. workers)
+    """
+    l,offsets=queryCSR(self.tree,points,r,**kwargs)
+    l=self.rows[l]
+    if self.nremoved>0:
+      keep=l>=0
+      l,offsets=l[keep],_mask2offsets(keep,offsets)
+    if self.delta is None:return l,offsets
+    
+    dl,doffsets=queryCSR(self.delta,points,r,**kwargs)
+    dl=self.deltaRows[dl]
+    
+    # Merge rows, base rows are always smaller than delta rows
+    rows=np.concatenate((csrRows(offsets),csrRows(doffsets)))
+    order=np.argsort(rows,kind='stable')
+    l=np.concatenate((l,dl))[order]
+    offsets=offsets+doffsets
+    return l,offsets
+
+  def queryPoint(self,x,y,r):
+    """
+    Search neighbours of a single point within distance r.
+    Lower overhead than query for scalar lookups.
+    
+    Output
+    ------
+    1D ndarray(int): current rows
+    """
+    l=self.rows[self.tree.query_ball_point((x,y),r)]
+    if self.nremoved>0:l=l[l>=0]
+    if self.delta is None:return l
+    return np.concatenate((l,self.deltaRows[self.delta.query_ball_point((x,y),r)]))
+
+class SegmentGrid(object):
+  """
+  Uniform grid of segments
+  
+  Every segment is stored in the cells it crosses (column by column), not in all cells of its bounding box.
+  Memory scales with the length of the segments divided by the cell size.
+  
+  Parameters
+  ----------
+  segments:2D ndarray : [[x0,y0,x1,y1]]
+  size:float
+    Cell size, usually the search distance
+  """
+  def __init__(self,segments,size):
+    segments=np.asarray(segments,dtype=np.float64).reshape(-1,4)
+    self.size=float(size)
+    self.origin=np.min(np.concatenate((segments[:,:2],segments[:,2:])),axis=0) if len(segments) else np.zeros(2)
+    
+    # Segments in cell units, x0<=x1
+    u0=(segments[:,:2]-self.origin)/self.size
+    u1=(segments[:,2:]-self.origin)/self.size
+    swap=u0[:,0]>u1[:,0]
+    u0[swap],u1[swap]=u1[swap],u0[swap].copy()
+    c0=np.floor(u0[:,0]).astype(np.int64)
+    c1=np.floor(u1[:,0]).astype(np.int64)
+    
+    # (segment,column) pairs, y range of the segment inside the column
+    counts=c1-c0+1
+    segs=np.repeat(np.arange(len(segments)),counts)
+    cx=np.arange(np.sum(counts))-np.repeat(np.cumsum(counts)-counts,counts)+c0[segs]
+    a,b=u0[segs],u1[segs]
+    dx=b[:,0]-a[:,0]
+    with np.errstate(divide='ignore',invalid='ignore'):
+      slope=np.where(dx>0,(b[:,1]-a[:,1])/dx,0.0)
+    xa=np.maximum(a[:,0],cx)
+    xb=np.minimum(b[:,0],cx+1)
+    ya=np.where(dx>0,a[:,1]+(xa-a[:,0])*slope,a[:,1])
+    yb=np.where(dx>0,a[:,1]+(xb-a[:,0])*slope,b[:,1])
+    # Small margin for rounding at cell borders
+    y0=np.maximum(np.floor(np.minimum(ya,yb)-1e-9),0).astype(np.int64)
+    y1=np.floor(np.maximum(ya,yb)+1e-9).astype(np.int64)
+    self.ny=int(np.max(y1))+2 if len(segments) else 1
+    
+    # All (cell,segment) pairs
+    counts=y1-y0+1
+    pairs=np.repeat(np.arange(len(segs)),counts)
+    cy=np.arange(np.sum(counts))-np.repeat(np.cumsum(counts)-counts,counts)+y0[pairs]
+    keys=self.key(cx[pairs],cy)
+    order=np.argsort(keys,kind='stable')
+    self.keys=keys[order]
+    self.segments=segs[pairs][order]
+  
+  def cell(self,xy):
+    return np.floor((xy-self.origin)/self.size).astype(np.int64)
+  
+  def key(self,cx,cy):
+    return cx*self.ny+cy
+  
+  def query(self,points):
+    """
+    Segments in the 3x3 cells around every point, i.e. all segments within distance size (and a few more).
+    A segment can be returned more than once for the same point.
+    
+    Output
+    ------
+    indices,offsets:CSR arrays (see ll2csr)
+    """
+    c=self.cell(np.asarray(points)[:,:2])
+    dx,dy=np.meshgrid([-1,0,1],[-1,0,1])
+    cx=c[:,0,None]+dx.ravel()
+    cy=c[:,1,None]+dy.ravel()
+    valid=(cy>=0)&(cy<self.ny)
+    keys=np.where(valid,self.key(cx,cy),-1)
+    start=np.searchsorted(self.keys,keys,side='left')
+    end=np.searchsorted(self.keys,keys,side='right')
+    lengths=np.where(valid,end-start,0).ravel()
+    start=start.ravel()
+    
+    offsets=np.zeros(len(c)+1,dtype=np.intp)
+    np.cumsum(lengths.reshape(-1,9).sum(axis=1),out=offsets[1:])
+    flat=np.arange(offsets[-1])-np.repeat(np.cumsum(lengths)-lengths,lengths)+np.repeat(start,lengths)
+    return self.segments[flat],offsets
+
+def _mask2offsets(keep,offsets):
+  """
+  New offsets after removing flat elements
+  """
+  cumsum=np.zeros(len(keep)+1,dtype=np.intp)
+  np.cumsum(keep,out=cumsum[1:])
+  return cumsum[offsets]
@@ -0,0 +1,60 @@
+import os
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor
+
+def nworkers(workers):
+  """
+  Number of workers. Negative values count from the number of cpus (-1 uses all cpus), similar to scipy.
+  """
+  if workers is None:return 1
+  if workers<0:return max(1,(os.cpu_count() or 1)+1+workers)
+  return max(1,workers)
+
+# State shared once per process worker (see initWorker)
+_workerState={}
+
+def initWorker(state):
+  """
+  Process pool initializer. The state (i.e. a density field) is pickled once per worker instead of once per task.
+  
+  Parameters
+  ----------
+  state:dict
+  """
+  _workerState.update(state)
+
+def workerState(key):
+  """
+  Value saved by initWorker in the current worker
+  """
+  return _workerState[key]
+
+@contextmanager
+def getExecutor(workers=None,executor=None,process=False,**kwargs):
+  """
+  Context manager that returns an executor or None if the work should run serially.
+
+  Parameters
+  ----------
+  workers:int
+    Number of workers. None or 1 runs serially. -1 uses all cpus.
+  executor:concurrent.futures.Executor,optional
+    User executor. It is returned as-is and is not shut down.
+  process:bool
+    If True, creates a ProcessPoolExecutor instead of a ThreadPoolExecutor
+  kwargs:
+    Passed to the executor (i.e. initializer,initargs)
+  """
+  if executor is not None:
+    yield executor
+    return
+  n=nworkers(workers)
+  if n==1:
+    yield None
+    return
+  Executor=ProcessPoolExecutor if process else ThreadPoolExecutor
+  pool=Executor(max_workers=n,**kwargs)
+  try:
+    yield pool
+  finally:
+    pool.shutdown()
@@ -18,8 +18,8 @@ from .io import point2numpy,linestring2numpy,polygon2numpy,multipoint2numpy,\
 
 
 from .spatial import DF
-from .spatial import removeHoles_Polygon,remove_Polygons,dsimplify_Polygon,\
-inearest_Polygon,resample_LineString,resample_Polygon,dresample_LineString,dresample_Polygon
+from .spatial import removeHoles_Polygon,remove_Polygons,dsimplify_Polygon,dsimplify_MultiPolygon,\
+inearest_Polygon,inearest_MultiPolygon,resample_LineString,resample_Polygon,dresample_LineString,dresample_Polygon,dresample_MultiPolygon
 
 
 from .plot import plotPoints,plotLineString,plotLineStrings,plotPolygon,plotPolygons,plotSave
@@ -193,7 +193,7 @@ def xy(self):
 def write(self,path,*args, **kwargs):
   """
   Write geometry object to file depending on the file extension.
-  Works for geojson and shapefile.
+  Works for geojson, shapefile and columnar (mshp) files.
   
   Parameters
   ----------
@@ -203,8 +203,11 @@ def write(self,path,*args, **kwargs):
    Creates it automatically unless specified.
   properties: list,optional
    Length must be equal to length of the object.  
+  kwargs:
+   Other options are passed to the writer (i.e. precision and chunkSize, see GIS.writeGeoJSON)
   """
-  GIS(self,*args, **kwargs).write(path)
+  gisKwargs={key:kwargs.pop(key) for key in ['properties','schema'] if key in kwargs}
+  GIS(self,*args,**gisKwargs).write(path,**kwargs)
   return self
 
 
@@ -288,7 +291,7 @@ def dresample(self, *args, **kwargs):
 
 @add_method(MultiPolygon)
 def dresample(self, *args, **kwargs):
-  return MultiPolygon([polygon.dresample(*args, **kwargs) for polygon in self])
+  return dresample_MultiPolygon(self, *args, **kwargs)
 dresample.__doc__=dresample_Polygon.__doc__
 
 # 
@@ -426,8 +429,8 @@ def dsimplify(self,*args,**kwargs):
 
 @add_method(MultiPolygon)
 def dsimplify(self,*args,**kwargs):
-  return cascaded_union([polygon.dsimplify(*args, **kwargs) for polygon in self])
-dsimplify.__doc__ = dsimplify_Polygon.__doc__
+  return dsimplify_MultiPolygon(self,*args,**kwargs)
+dsimplify.__doc__ = dsimplify_MultiPolygon.__doc__
 
 #
 # Compute nearest interior nodes
@@ -446,9 +449,7 @@ def inearest(self,*args,**kwargs):
 
 @add_method(MultiPolygon)
 def inearest(self,*args,**kwargs):
-  a=numpy.array([polygon.inearest(*args, **kwargs) for polygon in self])
-  l,m,n=a.shape
-  return numpy.reshape(a, (l*m, n)) 
+  return inearest_MultiPolygon(self,*args,**kwargs)
 inearest.__doc__ = inearest_Polygon.__doc__
 
 #
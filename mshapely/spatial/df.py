@@ -1,10 +1,13 @@
+import os
+import pickle
+from functools import lru_cache
 import numpy as np
-from scipy import spatial
 import matplotlib.pyplot as plt
 from shapely.geometry import Point,GeometryCollection
 from tqdm import tqdm
-from ..io import GIS
-from ..misc import ll2numpy
+from ..io import GIS,saveNpz,loadNpz
+from concurrent.futures import ThreadPoolExecutor
+from ..misc import Index,csrRows,segmentMin,segmentArgmin,nworkers
 
 def check(function):
   """
@@ -43,12 +46,31 @@ class DF(object):
     balanced_tree is a kdtree parameter
   nvalue:int
     Number of points search in the kdtree. Higher memory is required for higher point number. 
+  simplify:str
+    Simplification engine, "dominance" (default) or "step" (see _simplifyPoints and _simplifyStep)
+  useGrid:bool
+    If True and a grid was created with toGrid, getDensity interpolates the grid instead of searching the kdtree.
+  workers:int
+    Number of threads used by getDensity. The nvalue chunks are processed in parallel. -1 uses all cpus.
+    The thread pool is created on the first parallel call and reused by the next calls (see close).
+  executor:concurrent.futures.Executor
+    Executor (threads or processes) used by getDensity instead of its own thread pool
+  cacheSize:int
+    Maximum number of values saved in the densityAt cache. None or 0 disables the cache.
+  cacheResolution:float
+    densityAt coordinates are snapped to this resolution before the cache lookup. Default is minDensity*0.01
   Attributes
   ----------
   dp: ndarray,
     shape:(npoints,6),[[x,y,density,growth,groupId,pointId]]
+  index: Index,
+    Dynamic kdtree of the density points
+  grid: dict,
+    Gridded density field created by toGrid, {x0,y0,resolution,z}. None if not created.
+  gridError: float,
+    Maximum interpolation error of the grid against the exact density field.
   """
-  def __init__(self,array=None,balanced_tree=True,step=1,nvalue=1000,progress=False,**kwargs):
+  def __init__(self,array=None,balanced_tree=True,step=1,nvalue=1000,progress=False,useGrid=True,workers=1,executor=None,simplify="dominance",cacheSize=None,cacheResolution=None,**kwargs):
     self.minDensity=kwargs.pop('minDensity', None)
     self.maxDensity=kwargs.pop('maxDensity', None)
     self.minGrowth=kwargs.pop('minGrowth', None)
@@ -58,6 +80,17 @@ class DF(object):
     self.step=step
     self.nvalue =nvalue
     self.progress=progress
+    self.simplify=simplify
+    self.useGrid=useGrid
+    self.workers=workers
+    self.executor=executor
+    self._pool=None
+    self._poolWorkers=None
+    self.grid=None
+    self.gridError=None
+    self._gridArgs=None
+    self.cacheResolution=cacheResolution
+    self.setCache(cacheSize)
     if array is not None:
       self.add(array,**kwargs)
   
@@ -70,13 +103,17 @@ class DF(object):
     
     return array
     
-  def add(self,array,minDensity=None,maxDensity=None,minGrowth=None,maxDensitySimplify=None):
+  def add(self,array,minDensity=None,maxDensity=None,minGrowth=None,maxDensitySimplify=None,incremental=True):
     """
     Add points to the density field
     
     Parameters
     ----------
     array: 2D ndarray : [[x,y,density,growth]]
+    incremental:bool
+      If True, new points are only checked against the existing field and
+      existing points dominated by the new points are removed from the index (see _addIncremental).
+      If False, all points are simplified again and the kdtree is rebuilt.
     
     Note
     ----------
@@ -106,11 +143,63 @@ class DF(object):
     groupId=len(np.unique(self.dp)) if self.dp is not None else 0
     npoint = len(array)
     array = np.column_stack((array,np.ones(npoint)*groupId,np.arange(npoint)))
+    if self.dp is not None and len(self.dp) and incremental:return self._addIncremental(array)
     array=np.concatenate((self.dp,array)) if self.dp is not None else array
     
     self._simplify(array)
     return self
   
+  def _addIncremental(self,points):
+    """
+    Add points to an existing density field without simplifying the existing points again
+    
+    Parameters
+    ----------
+    points:ndarray : [[x,y,density,growth,groupId,pointId]] 
+    
+    Note
+    ----
+    1. New points are simplified with themselves.
+    2. New points within a meter of an existing point or dominated by the existing field are removed.
+       A point is dominated when the field at its location is smaller or equal to its density.
+    3. Existing points dominated by the new points are removed.
+       Only existing points within the influence distance of the new points are searched.
+    4. The index is updated (masked removals and appended points) instead of being rebuilt.
+    """
+    points=self._simplifyPoints(points)
+    dp=self.dp
+    index=self.index
+    maxDistance = DF.getl_D(self.minDensity,self.minGrowth,self.maxDensitySimplify)
+    minDensity = np.minimum(np.min(dp[:,2]),np.min(points[:,2]))
+    minSlope = np.minimum(np.min(dp[:,3]),np.min(points[:,3]))-1.0
+    
+    # Remove new points that are duplicates (to a meter) or dominated by the existing field
+    radius = np.clip((points[:,2]-minDensity)/minSlope,np.sqrt(2.0),maxDistance)
+    l,offsets = index.query(points[:,:2],radius)
+    rows = csrRows(offsets)
+    distances = np.linalg.norm(dp[l,:2]-points[rows,:2],axis=1)
+    dd = DF.getD_l(dp[l,2],dp[l,3],distances)
+    duplicate = np.all(np.round(dp[l,:2],0)==np.round(points[rows,:2],0),axis=1)
+    dd[duplicate] = -np.inf
+    points = points[segmentMin(dd,offsets) > points[:,2]]
+    
+    if len(points)!=0:
+      # Remove existing points dominated by the new points
+      radius = np.clip((self.maxDensity-points[:,2])/(points[:,3]-1.0),0,maxDistance)
+      l,offsets = index.query(points[:,:2],radius)
+      rows = csrRows(offsets)
+      distances = np.linalg.norm(dp[l,:2]-points[rows,:2],axis=1)
+      dd = DF.getD_l(points[rows,2],points[rows,3],distances)
+      keep = np.ones(len(dp),dtype=bool)
+      keep[l[dd<dp[l,2]]] = False
+      
+      index.remove(keep)
+      index.append(points[:,:2])
+      self.dp = np.concatenate((dp[keep],points))
+    
+    self._reset()
+    return self
+  
   def inearest(self,geo,minLength=False,**kwargs):
     """
     Compute density field based on interior nearest points
@@ -137,6 +226,66 @@ class DF(object):
     
   
   def _simplify(self,points):
+    """
+    Simplify density points and build the index
+    """
+    self.dp=self._simplifyPoints(points)
+    self.index=Index(self.dp[:,:2],balanced_tree=self.balanced_tree)
+    self._reset()
+    return self
+  
+  def _reset(self):
+    """
+    Density points changed. The grid (recreated on the next getDensity) and the cache are out of date.
+    """
+    self.grid=None
+    self.clearCache()
+  
+  def _simplifyPoints(self,points):
+    """
+    Simplify/remove uninfluential density points
+    
+    Parameters
+    ----------
+    points:ndarray : [[x,y,density,growth]] 
+    
+    Note
+    ----
+    A point is kept if it gives the minimum density of at least one remaining point (itself included).
+    The search is limited to the distance of maxDensitySimplify (last step of _simplifyStep).
+    A point p can only be beaten at its location by points closer than (density_p-minDensity)/(minGrowth-1).
+    The search distance is also doubled at every pass (instead of every growth step),
+    so most uninfluential points are removed with small neighbour lists in log2(maxDistance/minDensity) passes.
+    At the last distance, the search is repeated until no point is removed (usually 1 or 2 passes).
+    """ 
+    if self.simplify=="step":return self._simplifyStep(points)
+    minDensity=self.minDensity
+    minGrowth=self.minGrowth
+    maxDensitySimplify=self.maxDensitySimplify
+    
+    newpoints=self._unique(points)
+    
+    # Search distance of the first and last step of the stepping approach
+    n = DF.getn_D(minDensity,minGrowth,maxDensitySimplify)
+    if n<1:return newpoints
+    n = 1+np.floor((n-1)/self.step)*self.step
+    maxDistance = DF.getl_D(minDensity,minGrowth,DF.getD_n(minDensity,minGrowth,n))
+    distance = np.minimum(DF.getl_D(minDensity,minGrowth,DF.getD_n(minDensity,minGrowth,1)),maxDistance)
+    
+    if self.progress:t=tqdm(total=int(np.ceil(np.log2(maxDistance/distance)))+1,position=1)
+    while True:
+      slope = np.min(newpoints[:,3])-1.0
+      radius = np.minimum((newpoints[:,2]-np.min(newpoints[:,2]))/slope,distance)
+      keepindices = self.getDensity(newpoints[:,:2],dp=newpoints,return_index=True,radius=radius)
+      uniques=np.unique(keepindices)
+      if distance==maxDistance and len(uniques)==len(newpoints):break
+      newpoints=newpoints[uniques]
+      if distance<maxDistance and self.progress:t.update(1)
+      distance=np.minimum(distance*2.0,maxDistance)
+    if self.progress:t.close()
+    return newpoints
+  
+  def _simplifyStep(self,points):
     """
     Simplify/remove uninfluential density points
     
@@ -151,16 +300,9 @@ class DF(object):
     """ 
     minDensity=self.minDensity
     minGrowth=self.minGrowth
-    maxDensity=self.maxDensity
-    balanced_tree = self.balanced_tree
     maxDensitySimplify=self.maxDensitySimplify
     
-    newpoints=points
-    
-    # Remove duplicates to a meter
-    v,i=np.unique(np.round(newpoints[:,:2],0),return_index=True,axis=0)
-    newpoints=newpoints[i]
-    print(minDensity,minGrowth,maxDensitySimplify)
+    newpoints=self._unique(points)
     n = DF.getn_D(minDensity,minGrowth,maxDensitySimplify)
     
     if self.progress:t=tqdm(total=int(n),position=1)
@@ -172,12 +314,82 @@ class DF(object):
       i=i+self.step
       if self.progress:t.update(self.step)
     if self.progress:t.close()
-    self.dp=newpoints
-    self.kdtree = spatial.cKDTree(newpoints[:,:2],balanced_tree=balanced_tree)
-    return self 
+    return newpoints
   
+  @staticmethod
+  def _unique(points):
+    """
+    Remove duplicates to a meter
+    """
+    v,i=np.unique(np.round(points[:,:2],0),return_index=True,axis=0)
+    return points[i]
   
-  def getDensity(self,tp,maxDensity=None,dp=None,return_index=False):
+  def toGrid(self,extent=None,resolution=None):
+    """
+    Precompute the density field on a regular grid.
+    Subsequent getDensity calls (and therefore dresample and plot) use bilinear interpolation
+    of the grid for target points inside the grid extent. Points outside the extent use the exact field.
+    
+    Parameters
+    ----------
+    extent:1D ndarray : [minx,miny,maxx,maxy]
+      Grid extent. If not specified, it uses the extent of the density points
+    resolution:float
+      Grid cell size. Default is minDensity
+    
+    Note
+    ----
+    The density field min(density+(growth-1)*distance) is Lipschitz continuous with constant L=max(growth)-1.
+    The bilinear interpolation is a weighted average of the 4 cell nodes and
+    the weighted distance to the nodes is at most resolution/sqrt(2) (cell centre).
+    The interpolation error is therefore bounded by L*resolution/sqrt(2) and saved in gridError.
+    The grid is recreated automatically when density points are added.
+    """
+    if extent is None:extent=self.extent
+    if resolution is None:resolution=self.minDensity
+    if resolution<=0:raise Exception("Resolution needs to be larger than 0.0")
+    xmin,ymin,xmax,ymax=extent
+    
+    nx = int(np.ceil((xmax-xmin)/resolution))+1
+    ny = int(np.ceil((ymax-ymin)/resolution))+1
+    x = xmin+np.arange(nx)*resolution
+    y = ymin+np.arange(ny)*resolution
+    xx, yy = np.meshgrid(x, y)
+    
+    self.grid=None
+    self._gridArgs=None
+    z=self.getDensity(np.column_stack((xx.ravel(),yy.ravel()))).reshape((ny,nx))
+    
+    self._gridArgs=(extent,resolution)
+    self.grid=dict(x0=xmin,y0=ymin,resolution=resolution,z=z)
+    self.gridError=(np.max(self.dp[:,3])-1.0)*resolution/np.sqrt(2.0)
+    self.clearCache()
+    return self
+  
+  def _getGridDensity(self,tp):
+    """
+    Bilinear interpolation of the grid. Returns nan for points outside the grid.
+    """
+    grid=self.grid
+    z=grid['z']
+    ny,nx=z.shape
+    fx=(tp[:,0]-grid['x0'])/grid['resolution']
+    fy=(tp[:,1]-grid['y0'])/grid['resolution']
+    inside=(fx>=0)&(fx<=nx-1)&(fy>=0)&(fy<=ny-1)
+    
+    i=np.clip(np.floor(fx).astype(int),0,np.maximum(nx-2,0))
+    j=np.clip(np.floor(fy).astype(int),0,np.maximum(ny-2,0))
+    i1=np.minimum(i+1,nx-1)
+    j1=np.minimum(j+1,ny-1)
+    tx=np.clip(fx-i,0,1)
+    ty=np.clip(fy-j,0,1)
+    
+    results=(z[j,i]*(1-tx)+z[j,i1]*tx)*(1-ty)+(z[j1,i]*(1-tx)+z[j1,i1]*tx)*ty
+    results[~inside]=np.nan
+    return results
+  
+  
+  def getDensity(self,tp,maxDensity=None,dp=None,return_index=False,radius=None):
     """
     Get field density
     
@@ -193,18 +405,32 @@ class DF(object):
       Used during simplication and replaces self.dp.
     return_index:
       Used during simplication. It returns the index instead of values.
+    radius:float or 1D ndarray
+      Used during simplication. Search distance (per target point) instead of the maxDensity distance.
     Note
     ----
       dd=Density for every (sub)target point and density points
+      If a grid exists (see toGrid) and useGrid is True, target points inside the grid are interpolated.
     """
+    if self.useGrid and self._gridArgs is not None and dp is None and maxDensity is None and not return_index:
+      if self.grid is None:self.toGrid(*self._gridArgs)
+      tp=self._checkInput(tp)
+      results=self._getGridDensity(tp)
+      outside=np.isnan(results)
+      if np.any(outside):
+        useGrid,self.useGrid=self.useGrid,False
+        results[outside]=self.getDensity(tp[outside])
+        self.useGrid=useGrid
+      return results
+    
     minDensity = self.minDensity
     minGrowth  = self.minGrowth
     nvalue     = self.nvalue
     maxDensity = self.maxDensity if maxDensity is None else maxDensity
-    kdtree     = self.kdtree if dp is None else spatial.cKDTree(dp[:,:2],balanced_tree=self.balanced_tree)
+    index      = self.index if dp is None else Index(dp[:,:2],balanced_tree=self.balanced_tree)
     dp         = self.dp if dp is None else dp
     
-    maxDistance = DF.getl_D(minDensity,minGrowth,maxDensity)
+    maxDistance = DF.getl_D(minDensity,minGrowth,maxDensity) if radius is None else radius
     
     xy      = dp[:,:2]
     density = dp[:,2]
@@ -215,32 +441,207 @@ class DF(object):
     ntp=len(tp)
     
     results=np.zeros(ntp)
-    for x in range(0,ntp,nvalue):
-      
-      xn        = np.minimum(ntp,x+nvalue)
-      array     = np.arange(x,xn)
-      atp       = tp[array]
-      l,e         = ll2numpy(kdtree.query_ball_point(atp,maxDistance))
-      if l.shape[1]!=0:
-        distances = np.linalg.norm(xy[l] - atp[:,None], axis=2)
-        dd        = DF.getD_l(density[l],growth[l],distances)
-        dd[e]     = maxDensity
-  
-        if return_index:
-          ii=np.argmin(dd,axis=1)
-          results[x:xn]=np.squeeze(np.take_along_axis(l,ii[:,None],axis=1)) # Taking index (from min density) from l 
-        else:
-          dd[dd>maxDensity]=maxDensity
-          results[x:xn]=np.min(dd,axis=1)
-      else:
-        if return_index:raise Exception("Not coded for this condition")
-        results[x:xn]=maxDensity
+    args=(index,xy,density,growth,maxDensity,return_index)
+    chunks=[(x,np.minimum(ntp,x+nvalue)) for x in range(0,ntp,nvalue)]
+    def radius(x,xn):return maxDistance[x:xn] if np.ndim(maxDistance) else maxDistance
+    
+    executor=self._getExecutor() if len(chunks)>1 else None
+    if executor is None:
+      for x,xn in chunks:results[x:xn]=DF._getDensityChunk(tp[x:xn],radius(x,xn),*args,workers=self.workers)
+    else:
+      futures=[executor.submit(DF._getDensityChunk,tp[x:xn],radius(x,xn),*args) for x,xn in chunks]
+      for (x,xn),future in zip(chunks,futures):results[x:xn]=future.result()
     
     if return_index:return results.astype(int)
     return results
   
+  def densityAt(self,x,y):
+    """
+    Get field density at a single point.
+    Same value as getDensity (to floating point rounding) without the array and chunk overhead.
+    
+    Parameters
+    ----------
+    x,y:float
+    
+    Note
+    ----
+    If the cache is enabled (see setCache), the coordinates are snapped to cacheResolution
+    and the density of the snapped point is saved in a LRU cache.
+    The snapping error is bounded by (max(growth)-1)*cacheResolution/sqrt(2).
+    """
+    if self._cache is None:return self._densityAt(x,y)
+    if self.cacheResolution is None:self.cacheResolution=self.minDensity*0.01
+    resolution=self.cacheResolution
+    return self._cache(int(np.floor(x/resolution+0.5)),int(np.floor(y/resolution+0.5)))
+  
+  def _densityAt(self,x,y):
+    if self.useGrid and self._gridArgs is not None:
+      if self.grid is None:self.toGrid(*self._gridArgs)
+      value=self._getGridDensity(np.array([[x,y]]))[0]
+      if not np.isnan(value):return value
+    
+    maxDensity=self.maxDensity
+    l=self.index.queryPoint(x,y,DF.getl_D(self.minDensity,self.minGrowth,maxDensity))
+    return DF._densityOf(self.dp[l],x,y,maxDensity)
+  
+  @staticmethod
+  def _densityOf(dp,x,y,maxDensity):
+    """
+    Density at a single point from a (small) set of density points
+    """
+    if len(dp)==0:return maxDensity
+    dx=dp[:,0]-x
+    dy=dp[:,1]-y
+    d=dp[:,2]
+    g=dp[:,3]
+    # Same as DF.getD_l, without the input check
+    n=np.log(np.sqrt(dx*dx+dy*dy)*(g-1)/d+1)/np.log(g)
+    n[n<0.]=0.
+    return np.minimum(np.min(d*np.power(g,n)),maxDensity)
+  
+  def densityWindow(self,x,y,radius):
+    """
+    Density function for target points within radius of (x,y).
+    The kdtree is searched once and the returned function only evaluates the density points of the window.
+    
+    Parameters
+    ----------
+    x,y:float
+      Window centre
+    radius:float
+      Window radius
+    
+    Output
+    ------
+    function(x,y): same value as densityAt for points inside the window
+    
+    Note
+    ----
+    If the grid or the cache is enabled, it returns densityAt.
+    """
+    if self._cache is not None or (self.useGrid and self._gridArgs is not None):return self.densityAt
+    maxDensity=self.maxDensity
+    maxDistance=DF.getl_D(self.minDensity,self.minGrowth,maxDensity)
+    dp=self.dp[self.index.queryPoint(x,y,radius+maxDistance)]
+    return lambda x,y:DF._densityOf(dp,x,y,maxDensity)
+  
+  def setCache(self,cacheSize=1000000,cacheResolution=None):
+    """
+    Enable (or disable with cacheSize=None) the densityAt LRU cache.
+    
+    Parameters
+    ----------
+    cacheSize:int
+      Maximum number of saved values
+    cacheResolution:float
+      Snapping resolution. Default is minDensity*0.01
+    """
+    if cacheResolution is not None:self.cacheResolution=cacheResolution
+    self._cache=None
+    if not cacheSize:return self
+    
+    @lru_cache(maxsize=cacheSize)
+    def cache(i,j):
+      resolution=self.cacheResolution
+      return self._densityAt(i*resolution,j*resolution)
+    self._cache=cache
+    return self
+  
+  def _getExecutor(self):
+    """
+    Executor of getDensity: the user executor, the thread pool of the DF or None if workers is 1.
+    The thread pool is created once and recreated only if the number of workers changes.
+    """
+    if self.executor is not None:return self.executor
+    n=nworkers(self.workers)
+    if n==1:return None
+    if self._pool is None or self._poolWorkers!=n:
+      self.close()
+      self._pool=ThreadPoolExecutor(max_workers=n)
+      self._poolWorkers=n
+    return self._pool
+  
+  def close(self):
+    """
+    Shut down the thread pool of getDensity. It is created again by the next parallel call.
+    """
+    if self._pool is not None:self._pool.shutdown()
+    self._pool=None
+    self._poolWorkers=None
+    return self
+  
+  def __getstate__(self):
+    """
+    Pickle state (i.e. process pools). The LRU cache, the executor and the thread pool are not pickled, the cache is recreated empty.
+    """
+    state=self.__dict__.copy()
+    info=self.cacheInfo()
+    state['_cache']=None if info is None else info.maxsize
+    state['executor']=None
+    state['_pool']=None
+    state['_poolWorkers']=None
+    return state
+  
+  def __setstate__(self,state):
+    cacheSize=state.pop('_cache')
+    state.setdefault('_pool',None)
+    state.setdefault('_poolWorkers',None)
+    self.__dict__.update(state)
+    self.setCache(cacheSize)
+  
+  def clearCache(self):
+    if self._cache is not None:self._cache.cache_clear()
+    return self
+  
+  def cacheInfo(self):
+    """
+    Cache statistics (hits,misses,maxsize,currsize). None if the cache is disabled.
+    """
+    if self._cache is None:return None
+    return self._cache.cache_info()
+  
+  @staticmethod
+  def _getDensityChunk(atp,r,index,xy,density,growth,maxDensity,return_index,workers=1):
+    """
+    Compute density (or index) of a chunk of target points.
+    The values are returned instead of written in a shared array, chunks can run in threads or processes.
+    
+    Parameters
+    ----------
+    atp:2D ndarray : [[x,y]]
+      Target points of the chunk
+    r:float or 1D ndarray
+      Search distance (per target point)
+    """
+    l,offsets = index.query(atp,r,workers=workers)
+    if len(l)!=0:
+      distances = np.linalg.norm(xy[l] - atp[csrRows(offsets)], axis=1)
+      dd        = DF.getD_l(density[l],growth[l],distances)
+
+      if return_index:
+        ii=segmentArgmin(dd,offsets)
+        return np.where(ii>=0,l[ii],0) # Taking index (from min density) from l 
+      dd[dd>maxDensity]=maxDensity
+      return segmentMin(dd,offsets,maxDensity)
+    if return_index:raise Exception("Not coded for this condition")
+    return np.full(len(atp),maxDensity,dtype=float)
+  
   @staticmethod
-  def read(path):
+  def read(path,mmap_mode='r'):
+    """
+    Read density field from file
+    
+    Parameters
+    ----------
+    path:str
+      GIS file (geojson, shapefile or mshp) or binary file (npz).
+      GIS files are simplified again.
+    mmap_mode:str
+      Only used for npz. Memory-map mode of the density points, None reads it in memory.
+      Columnar (mshp) files are always memory-mapped.
+    """
+    if os.path.splitext(path)[1]==".npz":return DF._readNpz(path,mmap_mode)
     collection = GIS.read(path)
     properties=collection.properties
     schema=collection.schema
@@ -249,18 +650,65 @@ class DF(object):
     maxDensity=schema.get('maxDensity',None)
     minGrowth=schema.get('minGrowth',None)
     
-    density = list(map(lambda x:[x['density'],x['growth']],properties))
+    if hasattr(properties,'column'):density=np.column_stack((properties.column('density'),properties.column('growth')))
+    else:density = list(map(lambda x:[x['density'],x['growth']],properties))
     xy=points.xy
     dp=np.column_stack((xy,density))
     
     return DF(dp,minDensity=minDensity,maxDensity=maxDensity,minGrowth=minGrowth)
   
-  def write(self,path):
+  def write(self,path,kdtree=False):
+    """
+    Write density field to file
+    
+    Parameters
+    ----------
+    path:str
+      GIS file (geojson, shapefile or mshp) or binary file (npz).
+    kdtree:bool
+      Only used for npz. Saves the serialized kdtree to avoid building it on read.
+    """
+    if os.path.splitext(path)[1]==".npz":return self._writeNpz(path,kdtree)
     dp = self.dp
     mp=GeometryCollection(list(map(Point,dp[:,:2])))
     schema={"minDensity":self.minDensity,"maxDensity":self.maxDensity,"minGrowth":self.minGrowth}
     mp.write(path,properties=map(lambda x:{"density":x[0],"growth":x[1]},dp[:,[2,3]]),schema=schema)
     return self
+  
+  def _writeNpz(self,path,kdtree=False):
+    """
+    Write density points and field parameters to an uncompressed npz file.
+    
+    Note
+    ----
+    Arrays:
+      dp:(npoints,6) density points
+      parameters:[minDensity,maxDensity,minGrowth,maxDensitySimplify]
+      kdtree:uint8 pickled cKDTree of dp (optional)
+    """
+    arrays=dict(
+      dp=np.ascontiguousarray(self.dp,dtype=np.float64),
+      parameters=np.array([self.minDensity,self.maxDensity,self.minGrowth,self.maxDensitySimplify],dtype=np.float64)
+      )
+    if kdtree:
+      self.index.rebuild()
+      arrays['kdtree']=np.frombuffer(pickle.dumps(self.index.tree,protocol=pickle.HIGHEST_PROTOCOL),dtype=np.uint8)
+    saveNpz(path,**arrays)
+    return self
+  
+  @staticmethod
+  def _readNpz(path,mmap_mode='r'):
+    """
+    Read npz density field. Density points are not simplified again.
+    The kdtree is unpickled if saved, only read trusted files.
+    """
+    arrays=loadNpz(path,mmap_mode)
+    minDensity,maxDensity,minGrowth,maxDensitySimplify=arrays['parameters'].tolist()
+    df=DF(minDensity=minDensity,maxDensity=maxDensity,minGrowth=minGrowth,maxDensitySimplify=maxDensitySimplify)
+    df.dp=arrays['dp']
+    tree=pickle.loads(arrays['kdtree'].tobytes()) if 'kdtree' in arrays else None
+    df.index=Index(df.dp[:,:2],balanced_tree=df.balanced_tree,tree=tree)
+    return df
     
   @property
   def extent(self):
@@ -269,6 +717,23 @@ class DF(object):
     """
     return [np.min(self.dp[:,0]),np.min(self.dp[:,1]),np.max(self.dp[:,0]),np.max(self.dp[:,1])]
     
+  def subset(self,extent):
+    """
+    Density field of the density points within an extent. Points are not simplified again.
+    
+    Parameters
+    ----------
+    extent:1D ndarray : [minx,miny,maxx,maxy]
+    """
+    minx,miny,maxx,maxy=extent
+    dp=self.dp
+    inside=(dp[:,0]>=minx)&(dp[:,0]<=maxx)&(dp[:,1]>=miny)&(dp[:,1]<=maxy)
+    df=DF(balanced_tree=self.balanced_tree,nvalue=self.nvalue,useGrid=self.useGrid,simplify=self.simplify,
+      minDensity=self.minDensity,maxDensity=self.maxDensity,minGrowth=self.minGrowth,maxDensitySimplify=self.maxDensitySimplify)
+    df.dp=np.array(dp[inside])
+    df.index=Index(df.dp[:,:2],balanced_tree=df.balanced_tree)
+    return df
+  
   def plot(self,extent=None,nx=100,axe=None,fig=None,showDP=False):
     """
     Plot the densityField
@@ -0,0 +1,245 @@
+import numpy as np
+from scipy import ndimage,spatial
+from shapely.geometry import LineString,Polygon,MultiPolygon
+from shapely.ops import polygonize as _polygonize
+
+from .df import DF
+
+def _polygons(geometry):
+  if isinstance(geometry,Polygon):return [geometry]
+  return [g for g in getattr(geometry,'geoms',[]) if isinstance(g,Polygon)]
+
+def rasterize(geometry,x0,y0,resolution,shape):
+  """
+  Rasterize polygons using scanlines (even-odd rule).
+  A pixel is inside if its centre is inside.
+
+  Parameters
+  ----------
+  geometry:Polygon or MultiPolygon
+  x0,y0:float
+    Lower-left corner of the raster
+  resolution:float
+    Pixel size
+  shape:(ny,nx)
+
+  Output
+  ------
+  2D ndarray(bool), row i is y0+(i+0.5)*resolution
+  """
+  ny,nx=shape
+  rings=[np.asarray(ring.coords)[:,:2] for p in _polygons(geometry) if not p.is_empty for ring in [p.exterior,*p.interiors]]
+  mask=np.zeros((ny,nx+1),dtype=np.int32)
+  if len(rings)==0:return mask[:,:nx].astype(bool)
+
+  p0=np.concatenate([r[:-1] for r in rings])
+  p1=np.concatenate([r[1:] for r in rings])
+  p0,p1=p0[p0[:,1]!=p1[:,1]],p1[p0[:,1]!=p1[:,1]]
+  ymin=np.minimum(p0[:,1],p1[:,1])
+  ymax=np.maximum(p0[:,1],p1[:,1])
+
+  # Rows with a centre in [ymin,ymax)
+  start=np.clip(np.ceil((ymin-y0)/resolution-0.5),0,ny).astype(np.intp)
+  end=np.clip(np.ceil((ymax-y0)/resolution-0.5),0,ny).astype(np.intp)
+  counts=end-start
+  edges=np.repeat(np.arange(len(p0)),counts)
+  rows=np.arange(np.sum(counts))-np.repeat(np.cumsum(counts)-counts,counts)+start[edges]
+
+  y=y0+(rows+0.5)*resolution
+  a=p0[edges]
+  b=p1[edges]
+  x=a[:,0]+(y-a[:,1])*(b[:,0]-a[:,0])/(b[:,1]-a[:,1])
+  cols=np.clip(np.ceil((x-x0)/resolution-0.5),0,nx).astype(np.intp)
+  np.add.at(mask,(rows,cols),1)
+  return (np.cumsum(mask,axis=1)[:,:nx]%2)==1
+
+def erode(mask,radius,resolution=1.0):
+  """
+  Binary erosion with a disk, using the euclidean distance transform.
+  Pixels outside the raster are considered inside.
+  A radius smaller than the resolution doesn't change the mask.
+  """
+  if not np.any(mask) or radius<resolution:return mask
+  return ndimage.distance_transform_edt(mask,sampling=resolution)>radius
+
+def dilate(mask,radius,resolution=1.0):
+  """
+  Binary dilation with a disk, using the euclidean distance transform.
+  """
+  if not np.any(mask) or radius<resolution:return mask
+  return ndimage.distance_transform_edt(~mask,sampling=resolution)<=radius
+
+def fillHoles(mask,area=None,resolution=1.0):
+  """
+  Fill holes (background regions not connected to the raster border).
+
+  Parameters
+  ----------
+  area:float,optional
+    Only holes with an area smaller or equal to area are filled. None fills all holes.
+  """
+  labels,n=ndimage.label(~mask)
+  if n==0:return mask
+  border=np.unique(np.concatenate((labels[0],labels[-1],labels[:,0],labels[:,-1])))
+  fill=np.ones(n+1,dtype=bool)
+  fill[0]=False
+  fill[border]=False
+  if area is not None:
+    fill&=np.bincount(labels.ravel(),minlength=n+1)*resolution*resolution<=area
+  return mask|fill[labels]
+
+def _runs(edges,breaks):
+  """
+  Runs of consecutive edges along axis 0.
+  A run stops at the vertex between rows r and r+1 if breaks[r].
+
+  Output
+  ------
+  start,end,column: runs cover edges start..end-1 of column
+  """
+  cont=edges[:-1]&edges[1:]&~breaks
+  starts=edges.copy()
+  starts[1:]&=~cont
+  ends=edges.copy()
+  ends[:-1]&=~cont
+  sc,sr=np.nonzero(starts.T)
+  ec,er=np.nonzero(ends.T)
+  return sr,er+1,sc
+
+def polygonize(mask,x0,y0,resolution):
+  """
+  Polygons of the pixels of a mask, along the pixel edges.
+
+  Output
+  ------
+  Polygon or MultiPolygon
+  """
+  m=np.pad(mask,1)
+  # Padded pixel (i,j) covers [j,j+1]x[i,i+1] in padded units
+  V=m[:,:-1]!=m[:,1:]   # (H,W-1), vertical edge x=j+1, y in [i,i+1]
+  H=m[:-1,:]!=m[1:,:]   # (H-1,W), horizontal edge y=i+1, x in [j,j+1]
+  if not np.any(V):return Polygon()
+
+  # Break runs at vertices touched by an edge of the other orientation
+  hv=np.zeros((m.shape[0]+1,m.shape[1]+1),dtype=bool)
+  hv[1:-1,:-1]|=H
+  hv[1:-1,1:]|=H
+  vv=np.zeros_like(hv)
+  vv[:-1,1:-1]|=V
+  vv[1:,1:-1]|=V
+
+  lines=[]
+  start,end,col=_runs(V,hv[1:-1,1:-1])
+  x=x0+col*resolution
+  lines.extend(LineString([(_x,y0+(s-1)*resolution),(_x,y0+(e-1)*resolution)]) for _x,s,e in zip(x,start,end))
+  start,end,row=_runs(H.T,vv[1:-1,1:-1].T)
+  y=y0+row*resolution
+  lines.extend(LineString([(x0+(s-1)*resolution,_y),(x0+(e-1)*resolution,_y)]) for _y,s,e in zip(y,start,end))
+
+  polygons=[]
+  for face in _polygonize(lines):
+    p=face.representative_point()
+    i=int(np.floor((p.y-y0)/resolution))
+    j=int(np.floor((p.x-x0)/resolution))
+    if mask[i,j]:polygons.append(face)
+  if len(polygons)==1:return polygons[0]
+  return MultiPolygon(polygons)
+
+def _pointDistance(xy,x0,y0,resolution,shape):
+  """
+  Distance from every pixel centre to the nearest point.
+  Points are snapped to pixel centres, points outside the raster use a kdtree.
+  """
+  ny,nx=shape
+  ij=np.floor((xy-[x0,y0])/resolution).astype(np.intp)
+  inside=(ij[:,0]>=0)&(ij[:,0]<nx)&(ij[:,1]>=0)&(ij[:,1]<ny)
+  distance=np.full(shape,np.inf)
+  if np.any(inside):
+    background=np.ones(shape,dtype=bool)
+    background[ij[inside,1],ij[inside,0]]=False
+    distance=ndimage.distance_transform_edt(background,sampling=resolution)
+  if not np.all(inside):
+    y,x=np.mgrid[0:ny,0:nx]
+    centres=np.column_stack((x0+(x.ravel()+0.5)*resolution,y0+(y.ravel()+0.5)*resolution))
+    d,_=spatial.cKDTree(xy[~inside]).query(centres)
+    distance=np.minimum(distance,d.reshape(shape))
+  return distance
+
+def _dsimplifyRaster(polygon,groups,udensity,steps,minDensity,minGrowth,resolution,stats=None):
+  """
+  Raster version of dsimplify_Polygon zones.
+
+  The domain and density points are rasterized. Point buffers are thresholds of the distance transform
+  of the points, buffer/unbuffer are erosion and dilation with distance transforms, and removeHoles is a
+  labelling of the background. Only the final domain is polygonized.
+  Every operation is linear in the number of pixels and zones only use the window of their points.
+  The distance transform of the points of every group is computed once (float32).
+
+  Note
+  ----
+  The maximum geometric error is 2*sqrt(2)*resolution: snapping of the density points, rasterization
+  of the domain, polygonization along pixel edges and simplification of the pixel steps (sqrt(2)/2*resolution each).
+  The error is relative to the zones without simplification. The vector engine simplifies the domain
+  with a tolerance of 1 at every step, the distance to the vector engine is not bounded by the resolution.
+  """
+  minx,miny,maxx,maxy=polygon.bounds
+  pad=2*resolution+1.0
+  x0,y0=minx-pad,miny-pad
+  shape=(int(np.ceil((maxy-miny+2*pad)/resolution)),int(np.ceil((maxx-minx+2*pad)/resolution)))
+  domain=rasterize(polygon,x0,y0,resolution,shape)
+  if stats is not None:stats.update(raster=shape)
+
+  # Distance to the domain boundary (erosion of mps&domain) and to the points of every group, computed once
+  inside=ndimage.distance_transform_edt(domain,sampling=resolution)
+  dmax=float(np.max(steps)) if len(steps) else 0.0
+  windows=[]
+  distances=[]
+  for xy in groups:
+    i0,j0=np.maximum(np.floor((np.min(xy,axis=0)-dmax-[x0,y0])/resolution).astype(int)-2,0)[::-1]
+    i1,j1=np.minimum(np.ceil((np.max(xy,axis=0)+dmax-[x0,y0])/resolution).astype(int)+2,shape[::-1])[::-1]
+    windows.append((i0,i1,j0,j1))
+    distances.append(_pointDistance(xy,x0+j0*resolution,y0+i0*resolution,resolution,(max(i1-i0,0),max(j1-j0,0))).astype(np.float32) if i1>i0 and j1>j0 else None)
+
+  ndomain=None
+  prev=None
+  for d in steps:
+    d=float(d)
+    zones=np.zeros(shape,dtype=bool)
+    ozones=np.zeros(shape,dtype=bool)
+    for xy,unique,(wi0,wi1,wj0,wj1),distance in zip(groups,udensity,windows,distances):
+      if distance is None:continue
+      _d=np.maximum(minDensity,DF.getD_l(unique,minGrowth,d))
+      r=_d*0.2
+
+      # Window of the point buffers, with a margin of empty pixels
+      i0,j0=np.maximum(np.floor((np.min(xy,axis=0)-d-[x0,y0])/resolution).astype(int)-2,[wj0,wi0])[::-1]
+      i1,j1=np.minimum(np.ceil((np.max(xy,axis=0)+d-[x0,y0])/resolution).astype(int)+2,[wj1,wi1])[::-1]
+      if i1<=i0 or j1<=j0:continue
+      window=np.s_[i0:i1,j0:j1]
+
+      mps=distance[i0-wi0:i1-wi0,j0-wj0:j1-wj0]<=d
+      if r<resolution:
+        emps=mps
+        zone=mps&domain[window]
+      else:
+        # Distance to the complement of mps&domain is the minimum of both distances
+        inner=ndimage.distance_transform_edt(mps,sampling=resolution)
+        emps=inner>r
+        zone=dilate(np.minimum(inner,inside[window])>r,r,resolution)
+      if not np.any(zone):continue
+      zone=fillHoles(zone,np.pi*np.power(_d*0.1,2.),resolution)
+      zones[window]|=zone
+      ozones[window]|=fillHoles(zone)|emps
+
+    if ndomain is None:
+      ndomain,prev=zones,ozones
+      continue
+    if not np.any(zones):continue
+    newzones=dilate(zones&~prev,1.0,resolution)
+    if np.any(ozones):prev=ozones
+    ndomain|=newzones
+
+  if ndomain is None:ndomain=np.zeros(shape,dtype=bool)
+  if prev is not None:ndomain|=dilate(domain&~prev,1.0,resolution)
+  else:ndomain|=domain
+  return polygonize(ndomain,x0,y0,resolution).simplify(resolution*np.sqrt(2.0)*0.5)
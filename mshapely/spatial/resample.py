@@ -1,11 +1,53 @@
 import warnings
+from fractions import Fraction
+from itertools import repeat
 import numpy as np
 from scipy import spatial
-from shapely.geometry import mapping, shape, Point, LineString, Polygon,MultiPoint,MultiLineString
+from shapely.geometry import mapping, shape, Point, LineString, LinearRing, Polygon,MultiPoint,MultiLineString,MultiPolygon
 from shapely.ops import cascaded_union,split,nearest_points,linemerge,snap
 from tqdm import tqdm
 
 from .df import DF
+from ..misc import getExecutor,nworkers,initWorker,workerState,csrRows,segmentMin,SegmentGrid
+
+def _cumulativeLength(coords):
+  """
+  Cumulative length at every vertex of a coordinate array (first value is 0).
+  The sum is sequential, same as LineString.length.
+  """
+  d=np.diff(coords[:,:2],axis=0)
+  return np.concatenate(([0.0],np.cumsum(np.sqrt(d[:,0]*d[:,0]+d[:,1]*d[:,1]))))
+
+def _interpolate(coords,cumlength,lengths):
+  """
+  Points at distances along the line, vectorized version of LineString.interpolate.
+  
+  Parameters
+  ----------
+  coords:2D ndarray : [[x,y(,z)]]
+  cumlength:1D ndarray
+    Cumulative length of coords (see _cumulativeLength)
+  lengths:1D ndarray
+    Distances along the line, larger or equal to 0
+  
+  Note
+  ----
+  Uses the same segment (first segment ending after the distance) and
+  the same arithmetic as GEOS, so results are identical to LineString.interpolate.
+  """
+  lengths=np.asarray(lengths,dtype=np.float64)
+  nsegment=len(coords)-1
+  i=np.searchsorted(cumlength[1:],lengths,side='right')
+  end=i>=nsegment
+  i=np.minimum(i,nsegment-1)
+  p0=coords[i]
+  p1=coords[i+1]
+  d=p1[:,:2]-p0[:,:2]
+  frac=(lengths-cumlength[i])/np.sqrt(d[:,0]*d[:,0]+d[:,1]*d[:,1])
+  points=(p1-p0)*frac[:,None]+p0
+  points[frac<=0.0]=p0[frac<=0.0]
+  points[(frac>=1.0)|end]=p1[(frac>=1.0)|end]
+  return points
 
 def resample_LineString(linestring, maxLength=1.0):
   """
@@ -19,24 +61,22 @@ def resample_LineString(linestring, maxLength=1.0):
     Default is 1.0.
   """     
   if maxLength <= 0.0: return linestring
-  n = np.max([np.ceil(linestring.length / maxLength), 1.0])
-  length = linestring.length / n
-  segments = [Point(list(linestring.coords)[0])]
-  for i in range(int(n)):
-    p2 = linestring.interpolate(length * (i + 1))
-    segments.append(p2)
-  return LineString(segments)
+  coords = np.array(linestring.coords)
+  cumlength = _cumulativeLength(coords)
+  n = np.max([np.ceil(cumlength[-1] / maxLength), 1.0])
+  length = cumlength[-1] / n
+  points = _interpolate(coords,cumlength,length * (np.arange(int(n)) + 1))
+  return LineString(np.concatenate((coords[:1],points)))
 
 
 def _resample_Polygon(linestring, maxLength=1.0):
   if maxLength <= 0.0: return linestring
-  n = np.max([np.ceil(linestring.length / maxLength), 3.0])
-  length = linestring.length / n
-  segments = [Point(list(linestring.coords)[0])]
-  for i in range(int(n) - 1):
-    p2 = linestring.interpolate(length * (i + 1))
-    segments.append(p2)
-  return LineString(segments)
+  coords = np.array(linestring.coords)
+  cumlength = _cumulativeLength(coords)
+  n = np.max([np.ceil(cumlength[-1] / maxLength), 3.0])
+  length = cumlength[-1] / n
+  points = _interpolate(coords,cumlength,length * (np.arange(int(n) - 1) + 1))
+  return LineString(np.concatenate((coords[:1],points)))
 
 
 def resample_Polygon(polygon, *args, **kwargs):
@@ -46,7 +86,18 @@ def resample_Polygon(polygon, *args, **kwargs):
   return exterior.difference(interiors)
 resample_Polygon.__doc__=resample_LineString.__doc__
 
-def _dresample_LineString(linestring, df,progress=False):
+def _dresample_LineString(linestring, df,progress=False,lookahead=100):
+  """
+  Density resampling of a single LineString.
+  
+  Note
+  ----
+  The line is marched using its cumulative length table: points are located by binary search (see _interpolate)
+  instead of LineString.interpolate which is O(n) for every call.
+  The density points are searched once for a look-ahead window of the line (see DF.densityWindow) and
+  the density of every position inside the window is evaluated from that subset.
+  The right density of a step is reused when the step ends on it.
+  """
   minDensity=df.minDensity
   maxDensity=df.maxDensity
   minGrowth=df.minGrowth
@@ -55,42 +106,51 @@ def _dresample_LineString(linestring, df,progress=False):
     return linestring
   maxDistance=DF.getl_D(minDensity,minGrowth,maxDensity)
   
+  coords=np.array(linestring.coords)
   flip=False
-  if(df.getDensity([linestring.coords[-1]])<df.getDensity([linestring.coords[0]])):
+  if(df.densityAt(*coords[-1,:2])<df.densityAt(*coords[0,:2])):
     flip=True
-    linestring=LineString(reversed(linestring.coords))
+    coords=coords[::-1].copy()
+  cumlength=_cumulativeLength(coords)
+  totalLength=cumlength[-1]
+  
+  # Window length needs to include at least one step
+  windowLength=np.maximum(lookahead*minDensity,2.0*maxDensity)
+  window=dict(start=np.inf,end=-np.inf,density=None,length=None,value=None)
+  def density(length):
+    if length==window['length']:return window['value']
+    x,y=_interpolate(coords,cumlength,[length])[0,:2]
+    if length<window['start'] or length>window['end']:
+      window.update(start=length,end=length+windowLength,density=df.densityWindow(x,y,windowLength))
+    window.update(length=length,value=window['density'](x,y))
+    return window['value']
   
   length = 0
-  p = linestring.interpolate(length)
-  segments = [p]
+  segments = [length]
   end=[]
-  if progress:t=tqdm(total=int(linestring.length),position=1)
-  while (length+minDensity<= linestring.length):
-    pl=p
-    distancel = df.getDensity(pl.xy)
+  if progress:t=tqdm(total=int(totalLength),position=1)
+  while (length+minDensity<= totalLength):
+    distancel = density(length)
     tlength = length + distancel
-    pr = linestring.interpolate(tlength)
-    distancer = df.getDensity(pr.xy)
+    distancer = density(tlength)
     
-    distance =np.minimum(distancel,distancer)[0]   
+    distance =np.minimum(distancel,distancer)
     
     # This array is saved to smooth out the end
-    if(length+maxDistance>linestring.length):
+    if(length+maxDistance>totalLength):
       end.append(dict(distance=distance,length=length))
     
     length += distance
-    p = linestring.interpolate(length)
-    segments.append(p)
+    segments.append(length)
     
     if progress:t.update(int(distance))
   if progress:t.close()
 
   # Smooth out the end
   # Get last point, get density, smooth out using points within maxDistance
-  # print(LineString(segments))
-  extra = (length - linestring.length)
+  extra = (length - totalLength)
   n=len(end)
-  lp=df.getDensity([linestring.coords[-1]])
+  lp=df.densityAt(*coords[-1,:2])
   v = np.array([np.maximum(o['distance']-lp,0) for o in end])
   s = np.sum(v)
   
@@ -99,27 +159,20 @@ def _dresample_LineString(linestring, df,progress=False):
     s = np.sum(v)
   u=v/s*extra
   
-  # print(v,s,u,extra)
-  # print(segments)
   if(n!=0): # Special case when the segment is shorter than the minDensity
     segments = segments[:-n]
     
     length = end[0]['length']
-    # print(end)
     for i,_u in enumerate(u):
       length +=end[i]['distance']-_u
-      
-      p = linestring.interpolate(length)
-      segments.append(p)
+      segments.append(length)
     
     # Make sure the last point is equal
     segments = segments[:-1]
   
-  segments.append(linestring.coords[-1])
-  newlinestring = LineString(segments)
-  
-  if(flip):newlinestring=LineString(reversed(newlinestring.coords))
-  return newlinestring
+  points = np.concatenate((_interpolate(coords,cumlength,segments),coords[-1:]))
+  if(flip):points=points[::-1]
+  return LineString(points)
 
 def dresample_LineString(linestring,df,mp=None,*args, **kwargs):
   """ 
@@ -142,33 +195,92 @@ def dresample_LineString(linestring,df,mp=None,*args, **kwargs):
 
 
   
-def dresample_Polygon(polygon,*args, **kwargs):
-  progress=False
-  temp=kwargs
-  if 'progress' in kwargs:
-    progress=kwargs['progress']
-    del temp['progress']
+def _dresampleRing(coords,args,kwargs,df=None):
+  """
+  Density resampling of a ring (coordinates). Returns the new coordinates.
+  """
+  if df is None:df=workerState('df')
+  return np.array(dresample_LineString(LinearRing(coords),df,*args,**kwargs).coords)
+
+def _dresampleRings(rings,df,args,kwargs,workers=None,progress=False):
+  """
+  Density resampling of rings, in order.
   
-    
-  if progress:t=tqdm(total=len(polygon.interiors)+1,position=0)
-  exterior = Polygon(dresample_LineString(polygon.exterior,*args, **kwargs))
-  if progress:t.update(1)
-  interiors=[]
-  for interior in polygon.interiors:
-    _r = dresample_LineString(interior,*args, **kwargs)
-    
+  Parameters
+  ----------
+  rings:list[2D ndarray]
+  df: Density Field object
+  workers:int
+    Number of processes. The DF is sent once to every worker.
+  """
+  n=nworkers(workers) if len(rings)>1 else 1
+  with getExecutor(n,process=True,initializer=initWorker,initargs=(dict(df=df),)) as executor:
+    if executor is None:
+      results=(_dresampleRing(ring,args,kwargs,df) for ring in rings)
+    else:
+      chunksize=max(1,len(rings)//(4*n))
+      results=executor.map(_dresampleRing,rings,repeat(args),repeat(kwargs),chunksize=chunksize)
+    if progress:results=tqdm(results,total=len(rings),position=0)
+    return list(results)
+
+def _ringsPolygon(exterior,interiors):
+  """
+  Polygon from resampled rings. Degenerate interiors are removed.
+  """
+  exterior = Polygon(exterior)
+  _interiors=[]
+  for interior in interiors:
+    _r = LineString(interior)
     if len(_r.coords)<4 or not _r.is_ring:continue
     newinterior = Polygon(_r)
     if not newinterior.is_empty:
       _n= newinterior.exterior
       coords = _n.coords[::-1] if not _n.is_ccw else _n.coords
-      interiors.append(coords)
-    if progress:t.update(1)
-  if progress:t.close()
+      _interiors.append(coords)
+  return Polygon(exterior.exterior,_interiors)
+
+def dresample_Polygon(polygon,df,*args,workers=None,progress=False,**kwargs):
+  """ 
+  Resample object using a 2D Density Field object. 
+  The length of the segments are automatically calculated using the Density Field.
+  
+  Parameters
+  ----------
+  df: Density Field object
+  mp:MultiPoint,optional
+   MultiPoint are part of the resampling. 
+   An error will raise if the distance between points are smaller than minDensity.
+  workers:int
+    Number of processes used to resample the rings. -1 uses all cpus.
   
-  # raise Exception("asd")
-  return Polygon(exterior.exterior,interiors)
-dresample_Polygon.__doc__=dresample_LineString.__doc__
+  Note
+  ----
+  Rings are sent to the processes as coordinate arrays. The DF is pickled once per process.
+  """
+  rings=[np.array(polygon.exterior.coords)]+[np.array(interior.coords) for interior in polygon.interiors]
+  rings=_dresampleRings(rings,df,args,kwargs,workers,progress)
+  return _ringsPolygon(rings[0],rings[1:])
+
+def dresample_MultiPolygon(multipolygon,df,*args,workers=None,progress=False,**kwargs):
+  """ 
+  Resample object using a 2D Density Field object.
+  The rings of all polygons are resampled in the same process pool.
+  See dresample_Polygon.
+  """
+  polygons=list(multipolygon.geoms)
+  rings=[]
+  for polygon in polygons:
+    rings.append(np.array(polygon.exterior.coords))
+    rings.extend(np.array(interior.coords) for interior in polygon.interiors)
+  rings=_dresampleRings(rings,df,args,kwargs,workers,progress)
+  
+  results=[]
+  i=0
+  for polygon in polygons:
+    n=len(polygon.interiors)+1
+    results.append(_ringsPolygon(rings[i],rings[i+1:i+n]))
+    i+=n
+  return MultiPolygon(results)
 
 
 def _split_line_with_point(line, splitter):
@@ -219,17 +331,108 @@ def _split_line_with_point(line, splitter):
 
 
 def _split_line_with_multipoint(line, splitter):
-    """Split a LineString with a MultiPoint"""
-
-    assert(isinstance(line, LineString))
-    assert(isinstance(splitter, MultiPoint))
-
-    chunks = [line]
-    for pt in splitter.geoms:
-        new_chunks = []
-        for chunk in filter(lambda x: not x.is_empty, chunks):
-            # add the newly split 2 lines or the same line if not split
-            new_chunks.extend(_split_line_with_point(chunk, pt))
-        chunks = new_chunks
+  """
+  Split a LineString with a MultiPoint
+  
+  Parameters
+  ----------
+  line:LineString
+  splitter:MultiPoint
+  
+  Note
+  ----
+  Same semantics as splitting with every point one after the other (see _split_line_with_point):
+  coordinates are rounded to 12 decimals and only points on the interior of the line split it.
+  All points are located once: candidate segments are searched with a grid of the segments (SegmentGrid),
+  points are tested exactly on the segments and sorted by distance along the line.
+  The coordinate array is then cut in one pass.
+  """
+  assert(isinstance(line, LineString))
+  assert(isinstance(splitter, MultiPoint))
+  
+  coords=np.round(np.array(line.coords), 12)
+  points=np.array([pt.coords[0][:2] for pt in splitter.geoms]).reshape(-1,2)
+  lengths=_locatePoints(coords,points)
+  if len(lengths)==0:return [LineString(coords)]
+  
+  cumlength=_cumulativeLength(coords)
+  i=np.searchsorted(cumlength,lengths,side='left')
+  vertex=cumlength[i]==lengths
+  cuts=np.round(_interpolate(coords,cumlength,lengths),12)
+  cuts[vertex]=coords[i[vertex]]
+  
+  chunks=[]
+  start=0
+  head=coords[:0]
+  for _i,_vertex,cut in zip(i,vertex,cuts):
+    chunks.append(LineString(np.concatenate((head,coords[start:_i],cut[None]))))
+    head=cut[None]
+    start=_i+1 if _vertex else _i
+  chunks.append(LineString(np.concatenate((head,coords[start:]))))
+  return chunks
 
-    return chunks
\ No newline at end of file
+def _locatePoints(coords,points):
+  """
+  Distances along the line of the points located on the interior of the line.
+  
+  Parameters
+  ----------
+  coords:2D ndarray : [[x,y(,z)]]
+  points:2D ndarray : [[x,y]]
+  
+  Output
+  ------
+  1D ndarray: sorted and unique distances along the line
+  
+  Note
+  ----
+  Points on more than one segment use the first segment, same as LineString.project.
+  Line end points are not part of the interior and are excluded.
+  """
+  xy=coords[:,:2]
+  if len(points)==0 or len(xy)<2:return np.zeros(0)
+  p0=xy[:-1]
+  p1=xy[1:]
+  d=p1-p0
+  seglength=np.sqrt(d[:,0]*d[:,0]+d[:,1]*d[:,1])
+  
+  # Candidate segments, in the cells crossed by the segments (a long segment doesn't widen the search of every point)
+  positive=seglength[seglength>0]
+  grid=SegmentGrid(np.column_stack((p0,p1)),np.median(positive) if len(positive) else 1.0)
+  indices,offsets=grid.query(points)
+  rows=csrRows(offsets)
+  p=points[rows]
+  a=p0[indices]
+  b=p1[indices]
+  inbox=(p[:,0]>=np.minimum(a[:,0],b[:,0]))&(p[:,0]<=np.maximum(a[:,0],b[:,0]))&\
+        (p[:,1]>=np.minimum(a[:,1],b[:,1]))&(p[:,1]<=np.maximum(a[:,1],b[:,1]))
+  
+  # Orientation test, exact arithmetic for nearly collinear points
+  ab=b-a
+  ap=p-a
+  cross=ab[:,0]*ap[:,1]-ab[:,1]*ap[:,0]
+  tol=1e-12*(np.abs(ab[:,0]*ap[:,1])+np.abs(ab[:,1]*ap[:,0]))
+  onsegment=inbox&(cross==0)
+  for k in np.where(inbox&(cross!=0)&(np.abs(cross)<=tol))[0]:
+    _a,_b,_p=[tuple(map(Fraction,v)) for v in (a[k],b[k],p[k])]
+    onsegment[k]=(_b[0]-_a[0])*(_p[1]-_a[1])==(_b[1]-_a[1])*(_p[0]-_a[0])
+  
+  # First segment of every point
+  segment=segmentMin(np.where(onsegment,indices,len(seglength)),offsets,empty=len(seglength))
+  found=segment<len(seglength)
+  segment,points=segment[found],points[found]
+  
+  # Interior only
+  interior=~(np.all(points==xy[0],axis=1)|np.all(points==xy[-1],axis=1))
+  segment,points=segment[interior],points[interior]
+  
+  # Distance along the line, same arithmetic as LineString.project
+  cumlength=_cumulativeLength(coords)
+  a=p0[segment]
+  ab=d[segment]
+  with np.errstate(divide='ignore',invalid='ignore'):
+    factor=((points[:,0]-a[:,0])*ab[:,0]+(points[:,1]-a[:,1])*ab[:,1])/(ab[:,0]*ab[:,0]+ab[:,1]*ab[:,1])
+  factor[np.all(points==a,axis=1)]=0.0
+  factor[np.all(points==p1[segment],axis=1)]=1.0
+  lengths=cumlength[segment]+np.clip(factor,0.0,1.0)*seglength[segment]
+  return np.unique(lengths)
@@ -1,12 +1,18 @@
+import time
 import warnings
+from itertools import repeat
 import numpy as np
 from scipy import spatial
-from shapely.geometry import mapping, shape, Point, LineString, Polygon,MultiPoint,MultiLineString,MultiPolygon,GeometryCollection
-from shapely.ops import cascaded_union,split,nearest_points,linemerge,snap
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from shapely.geometry import mapping, shape, box, Point, LineString, Polygon,MultiPoint,MultiLineString,MultiPolygon,GeometryCollection
+from shapely.ops import cascaded_union,unary_union,split,nearest_points,linemerge,snap
+from shapely.strtree import STRtree
 from tqdm import tqdm
-from ..linalg import norm,rotate
+from ..linalg import norm
 from .df import DF
-from ..misc import ll2numpy
+from .raster import _dsimplifyRaster
+from ..misc import SegmentGrid,queryCSR,csrRows,segmentMin,getExecutor,nworkers,initWorker,workerState
 
 def removeHoles_Polygon(polygon, area=1.0):
   """
@@ -51,11 +57,147 @@ def cArea(d):
     diameter
   """
   return np.pi*np.power(d*0.5,2.)
-    
 
+def unionGroups(geometries):
+  """
+  Union of geometries grouped by overlapping bounding boxes (STRtree).
+  Only geometries of the same group are merged together, instead of a single global union.
+  
+  Parameters
+  ----------
+  geometries:list[Polygon or MultiPolygon]
+  
+  Output
+  ------
+  Polygon or MultiPolygon
+  """
+  geometries=[g for g in geometries if not g.is_empty]
+  if len(geometries)<2:return unary_union(geometries)
+  
+  n=len(geometries)
+  boxes=[box(*g.bounds) for g in geometries]
+  tree=STRtree(boxes,items=range(n))
+  pairs=[(i,j) for i,b in enumerate(boxes) for j in tree.query_items(b)]
+  rows,cols=np.array(pairs).T
+  ngroup,labels=connected_components(coo_matrix((np.ones(len(rows)),(rows,cols)),shape=(n,n)),directed=False)
+  
+  polygons=[]
+  for group in np.split(np.argsort(labels,kind='stable'),np.cumsum(np.bincount(labels))[:-1]):
+    part=geometries[group[0]] if len(group)==1 else unary_union([geometries[i] for i in group])
+    polygons.extend(getattr(part,'geoms',[part]))
+  polygons=[p for p in polygons if isinstance(p,Polygon) and not p.is_empty]
+  if len(polygons)==1:return polygons[0]
+  return MultiPolygon(polygons)
+
+def _getZone(tpolygon,xy,unique,d,minDensity,minGrowth,cache=None,union=False,grow=False):
+  """
+  Zone of a single density value (see dsimplify_Polygon).
+  
+  Parameters
+  ----------
+  cache:dict,optional
+    Cache of the same density value from the previous step, only used with grow.
+  union:bool
+    Buffer of the points as a unary_union of point buffers instead of MultiPoint.buffer.
+    Faster for groups of many points (see levels), same area to ~1e-11 relative.
+  grow:bool
+    The buffer of the points is grown by the difference of distance instead of being recreated,
+    and simplified with the chord error of the point buffers to keep the number of vertices similar.
+    If the buffer of a single point covers the bounds of the domain, the intersection is skipped.
+  
+  Output
+  ------
+  result:(zone,ozone) or None if the zone is empty
+  cache:dict, status is "created", "grown" or "saturated"
+  """
+  _d = DF.getD_l(unique,minGrowth,d)
+  _d = np.maximum(minDensity,_d) 
+  if cache is None:
+    if union:mps=unary_union([Point(p).buffer(d) for p in xy])
+    else:mps=MultiPoint(xy).buffer(d)
+    status="created"
+  else:
+    mps=cache['mps']
+    if d>cache['d']:mps=mps.buffer(float(d-cache['d'])).simplify(float(d)*(1.0-np.cos(np.pi/64)))
+    status="grown"
+  
+  saturated=False
+  if grow:
+    # Inscribed radius of a point buffer (16 segments per quarter circle) covers the domain bounds
+    minx,miny,maxx,maxy=tpolygon.bounds
+    dx=np.maximum(np.abs(xy[:,0]-minx),np.abs(xy[:,0]-maxx))
+    dy=np.maximum(np.abs(xy[:,1]-miny),np.abs(xy[:,1]-maxy))
+    saturated=len(xy)>0 and np.min(np.sqrt(dx*dx+dy*dy))<=d*np.cos(np.pi/64)
+  if saturated:
+    ozone=tpolygon
+    status="saturated"
+  else:
+    ozone=mps.intersection(tpolygon)
+  
+  result=None
+  zone=ozone.buffer(-_d*0.2).buffer(_d*0.2)
+  if not zone.is_empty:
+    zone=zone.removeHoles(cArea(_d*0.2)).simplify(_d*0.01)
+    if not zone.is_empty:result=(zone,zone.getExterior().union(mps.buffer(-_d*0.2)))
+  return result,dict(mps=mps,d=d,status=status,result=result)
+
+def _ncoords(geometry):
+  """
+  Number of coordinates of a Polygon or MultiPolygon
+  """
+  polygons=[geometry] if isinstance(geometry,Polygon) else getattr(geometry,'geoms',[])
+  return sum(len(p.exterior.coords)+sum(len(i.coords) for i in p.interiors) for p in polygons if not p.is_empty)
+
+def _simplifyDomain(polygon,tolerance):
+  """
+  Simplify (and fix) the domain. The same object is returned if no coordinate is removed.
+  """
+  simplified=polygon.simplify(tolerance)
+  if _ncoords(simplified)==_ncoords(polygon):return polygon
+  return simplified.buffer(0)
+
+def densityLevels(density,levels="growth",minDensity=None,minGrowth=None):
+  """
+  Quantize densities, rounded down to a ladder of levels
+  
+  Parameters
+  ----------
+  density:1D ndarray
+  levels:str or int
+    "growth": geometric ladder minDensity*minGrowth^k
+    int: number of geometric levels between the smallest and largest density
+  minDensity:float
+    Start of the "growth" ladder. Default is the smallest density
+  minGrowth:float
+    Ratio of the "growth" ladder
+  
+  Note
+  ----
+  Densities are always rounded down (finer resolution), the quantized field is never coarser than the original.
+  """
+  density=np.asarray(density,dtype=np.float64)
+  if len(density)==0:return density
+  if minDensity is None:minDensity=np.min(density)
+  if levels=="growth":
+    if minGrowth is None or minGrowth<=1.0:raise Exception("levels='growth' needs minGrowth>1")
+    k=np.floor(np.log(np.maximum(density,minDensity)/minDensity)/np.log(minGrowth)+1e-9)
+    return np.minimum(minDensity*np.power(minGrowth,k),density)
+  
+  if not isinstance(levels,(int,np.integer)) or levels<1:raise Exception("levels needs to be 'growth' or a positive integer")
+  ladder=np.geomspace(np.min(density),np.max(density),levels) if levels>1 else np.min(density,keepdims=True)
+  return ladder[np.maximum(np.searchsorted(ladder,density,side='right')-1,0)]
 
+STEPS = np.array([
+  1E1,2E1,4E1,7E1,
+  1E2,2E2,4E2,7E2,
+  1E3,2E3,4E3,7E3,
+  1E4,2E4,4E4,7E4,
+  1E5,2E5,4E5,7E5,
+  1E6,2E6,4E6,7E6,
+  1E7,2E7,4E7,7E7],dtype=np.float32)
+# STEPS = np.array([10,20,40,70,100,200,400,700,1000,2000,4000,7000,1E4,2E4],dtype=np.float32)
 
-def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,fine=None,coarse=None,progress=False):
+def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,fine=None,coarse=None,progress=False,workers=None,executor=None,levels=None,stats=None,tileSize=None,tileOverlap=None,engine="vector",resolution=None,grow=False,stepStats=None,steps=None):
   """
   Simplify polygons and remove points by respecting Density Field.
   It mainly uses the buffer/unbuffer techniques for different density area/zone.
@@ -73,58 +215,129 @@ def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,
     Fine resolution data
   coarse:Polygon or MultiPolygon
     Coarse resolution data
+  workers:int
+    Number of threads used to build the density zones. -1 uses all cpus.
+    If tileSize is defined, number of processes used for the tiles.
+  executor:concurrent.futures.Executor,optional
+    User executor for the density zones or the tiles
+  levels:str or int,optional
+    Quantize densities to bound the number of zones (see densityLevels).
+    "growth" uses a geometric ladder of minGrowth, an integer uses a fixed number of levels.
+  stats:dict,optional
+    Filled with the number of zones ("zones") and the number of merged density values ("merged")
+    or the number of tiles ("tiles")
+  tileSize:float,optional
+    Simplify the domain by square tiles (see _dsimplifyTiled)
+  tileOverlap:float,optional
+    Tile overlap. Default is the distance to reach maxDensity from minDensity (DF.getl_D)
+  engine:str
+    "vector": zones are shapely geometries
+    "raster": approximate zones on a raster (see raster._dsimplifyRaster). Densities are quantized with levels="growth" if levels is None.
+  resolution:float,optional
+    Pixel size of the "raster" engine. Default is minDensity.
+    The maximum geometric error of the raster engine is 2*sqrt(2)*resolution (see raster._dsimplifyRaster).
+    The vector engine simplifies the domain with a tolerance of 1 at every step, both engines can differ by more.
+  grow:bool
+    Grow the zones from the previous step instead of recreating them (see _getZone).
+    Saturated zones are reused while the domain doesn't change.
+    Faster, but the zones differ slightly from the default (~0.1% area).
+  stepStats:list,optional
+    Filled with the distance, time, domain reuse, zone counters
+    ("created","grown","saturated","reused","unreached") and "skipped" of every step
+  steps:array,optional
+    Buffer distances of the zones. Default is STEPS smaller than the length of the polygon.
+    Steps outside [minDensity,DF.getl_D(minDensity,minGrowth,limitCoarseDensity)) are removed.
+  
+  Note
+  ----
+  Zones of every density value are independent and built concurrently, followed by unary_union (GEOS cascaded union).
+  The union is not split between workers, results do not depend on the number of workers.
+  Threads only run concurrently if GEOS releases the GIL (shapely>=2).
+  
+  Density values with all points farther than the step distance from the domain bounds have no zone ("unreached")
+  and are not built. Steps whose zone set doesn't change (every zone unreached, or reused with grow) are skipped.
+  The domain (fine or coarse) is only fixed with buffer(0) if simplify removed coordinates.
   """
+  if tileSize is not None:
+    return _dsimplifyTiled(polygon,df,tileSize,tileOverlap,workers,executor,stats,
+      limitFineDensity=limitFineDensity,limitCoarseDensity=limitCoarseDensity,fine=fine,coarse=coarse,levels=levels,
+      engine=engine,resolution=resolution,grow=grow,steps=steps)
+  if engine not in ["vector","raster"]:raise Exception("engine needs to be 'vector' or 'raster'")
+  if engine=="raster" and levels is None:levels="growth"
   
   points = df.dp
   xy = points[:, [0, 1]]
   density = points[:, 2]
-  udensity = np.unique(density)
-  
-  steps = np.array([
-    1E1,2E1,4E1,7E1,
-    1E2,2E2,4E2,7E2,
-    1E3,2E3,4E3,7E3,
-    1E4,2E4,4E4,7E4,
-    1E5,2E5,4E5,7E5,
-    1E6,2E6,4E6,7E6,
-    1E7,2E7,4E7,7E7],dtype=np.float32)
-  # steps = np.array([10,20,40,70,100,200,400,700,1000,2000,4000,7000,1E4,2E4],dtype=np.float32)
-  steps=steps[steps<polygon.length]
+  if levels is not None:
+    density = densityLevels(density,levels,df.minDensity,df.minGrowth)
+  udensity,counts = np.unique(density,return_counts=True)
+  if stats is not None:
+    stats.update(zones=len(udensity),merged=len(np.unique(points[:, 2]))-len(udensity))
+  sxy = xy[np.argsort(density,kind='stable')]
+  offsets = np.concatenate(([0],np.cumsum(counts)))
+  groups = [sxy[offsets[k]:offsets[k+1]] for k in range(len(counts))]
+  
+  if steps is None:steps=STEPS[STEPS<polygon.length]
+  steps=np.asarray(steps,dtype=np.float32)
   minDensity = df.minDensity
   maxDensity = df.maxDensity
   minGrowth = df.minGrowth
   maxDensity=np.minimum(maxDensity,polygon.length*0.1)
   maxDistance = DF.getl_D(minDensity,minGrowth,limitCoarseDensity)
   
+  steps=steps[steps>=minDensity]
+  steps=steps[steps<maxDistance]
+  
   polygon=polygon.buffer(0)
+  if engine=="raster":
+    if resolution is None:resolution=minDensity
+    return _dsimplifyRaster(polygon,groups,udensity,steps,minDensity,minGrowth,resolution,stats)
+  
   if fine:fine=fine.buffer(0)
   else:fine=polygon
   if coarse:coarse=coarse.buffer(0)
   else:coarse=polygon
   
-  def getZones(tpolygon,d):
-    ozones=[]
-    zones=[]
-    for unique in udensity:
-      mps=MultiPoint(xy[density==unique]).buffer(d)
-      _d = DF.getD_l(unique,minGrowth,d)
-      _d = np.maximum(minDensity,_d) 
-      ozone=mps.intersection(tpolygon)
-      
-      zone=ozone.buffer(-_d*0.2).buffer(_d*0.2).removeHoles(cArea(_d*0.2)).simplify(_d*0.01)
-      
-      if not zone.is_empty:
-        ozones.append(zone.getExterior().union(mps.buffer(-_d*0.2)))
-      #  ozones.append(mps)
-        zones.append(zone)
+  caches=[None]*len(groups)
+  statuses=[None]*len(groups)
+  def getZones(tpolygon,d,reused,skip):
+    """
+    Zones and outer zones of all density values. None if the zone set is unchanged and skip is True.
+    """
+    # Density values without any point within d of the domain bounds have no zone
+    reached=np.zeros(len(groups),dtype=bool)
+    if not tpolygon.is_empty:
+      minx,miny,maxx,maxy=tpolygon.bounds
+      dx=np.maximum(np.maximum(minx-sxy[:,0],sxy[:,0]-maxx),0)
+      dy=np.maximum(np.maximum(miny-sxy[:,1],sxy[:,1]-maxy),0)
+      reached=segmentMin(np.sqrt(dx*dx+dy*dy),offsets)<=d*(1.0+1e-9)
+    
+    previous=statuses[:]
+    indices=[]
+    for i in range(len(groups)):
+      if not reached[i]:statuses[i]="unreached"
+      elif grow and reused and caches[i] is not None and caches[i]['status']=="saturated":statuses[i]="reused"
+      else:indices.append(i)
+    if skip and not indices and all(s=="reused" or p=="unreached" for s,p in zip(statuses,previous)):return None
     
-    ozones=cascaded_union(ozones)
-    zones=cascaded_union(zones)
+    args=(repeat(tpolygon),[groups[i] for i in indices],udensity[indices],repeat(d),repeat(minDensity),repeat(minGrowth),
+      [caches[i] for i in indices],repeat(levels is not None),repeat(grow))
+    if pool is None:results=list(map(_getZone,*args))
+    else:results=list(pool.map(_getZone,*args))
+    for i,(result,cache) in zip(indices,results):
+      statuses[i]=cache['status']
+      if grow:caches[i]=cache
+    results=dict(zip(indices,[r[0] for r in results]))
+    results=[caches[i]['result'] if statuses[i]=="reused" else results.get(i) for i in range(len(groups))]
+    results=[r for r in results if r is not None]
+    
+    zones=unary_union([r[0] for r in results])
+    ozones=unary_union([r[1] for r in results])
     # zones.plot("o-")
     return zones,ozones
   
   
-  def process(domain,newdomain,prev,d,outline=None):
+  def process(domain,newdomain,prev,d,outline=None,reused=False):
     if outline is not None:
       newzones=outline.difference(prev).buffer(1)
       
@@ -132,7 +345,12 @@ def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,
         newdomain=newdomain.union(newzones).buffer(0.01).simplify(1)
       return newdomain,prev
       
-    zones,ozones = getZones(domain,d)
+    zones = getZones(domain,d,reused,newdomain is not None)
+    if stepStats is not None:
+      stepStats[-1].update({status:statuses.count(status) for status in ["created","grown","saturated","reused","unreached"]})
+      stepStats[-1]['skipped']=zones is None
+    if zones is None:return newdomain,prev
+    zones,ozones=zones
     if newdomain is None:return zones,ozones
     if zones.is_empty:return newdomain,prev
     newzones=zones.difference(prev).buffer(1)
@@ -143,30 +361,32 @@ def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,
     # if i==11:newdomain.plot("o-")
     return newdomain,prev
   
-  
-  steps=steps[steps>=minDensity]
-  steps=steps[steps<maxDistance]
-  
   ndomain=None
   prev=None
   _dd=None
+  previous=None
   if progress:t=tqdm(total=len(steps), unit_scale=True)
-  for i,d in enumerate(steps):
-    _dd=DF.getD_l(minDensity,minGrowth,d)
-    if(_dd>limitFineDensity):
-      coarse=coarse.simplify(_dd*0.01).buffer(0)
-      opolygon=coarse
-    else:
-      fine=fine.simplify(_dd*0.01).buffer(0)
-      opolygon=fine
-    # opolygon.plot(polygonStyle={"facecolor":(0,0,0,0)})
-    
-    
-    ndomain,prev=process(opolygon,ndomain,prev,d)
-    # ndomain.plot()
-    # ndomain.savePlot("../data/example2/temp.{}.png".format(i))
-    # ndomain.plot()
-    if progress:t.update(1)
+  with getExecutor(workers,executor) as pool:
+    for i,d in enumerate(steps):
+      t0=time.time()
+      _dd=DF.getD_l(minDensity,minGrowth,d)
+      if(_dd>limitFineDensity):
+        coarse=_simplifyDomain(coarse,_dd*0.01)
+        opolygon=coarse
+      else:
+        fine=_simplifyDomain(fine,_dd*0.01)
+        opolygon=fine
+      # opolygon.plot(polygonStyle={"facecolor":(0,0,0,0)})
+      
+      reused=opolygon is previous
+      if stepStats is not None:stepStats.append(dict(distance=float(d),domainReused=reused))
+      previous=opolygon
+      ndomain,prev=process(opolygon,ndomain,prev,d,reused=reused)
+      if stepStats is not None:stepStats[-1]['time']=time.time()-t0
+      # ndomain.plot()
+      # ndomain.savePlot("../data/example2/temp.{}.png".format(i))
+      # ndomain.plot()
+      if progress:t.update(1)
   if progress:t.close()
   
   
@@ -178,6 +398,99 @@ def dsimplify_Polygon(polygon,df,limitFineDensity=1000,limitCoarseDensity=10000,
   return ndomain
 
 
+def _dsimplifyPolygon(polygon,df,args,kwargs):
+  if df is None:df=workerState('df')
+  return dsimplify_Polygon(polygon,df,*args,**kwargs)
+
+def dsimplify_MultiPolygon(multipolygon,df,*args,workers=None,executor=None,**kwargs):
+  """
+  Simplify every polygon by respecting Density Field (see dsimplify_Polygon) and merge the results.
+  
+  Parameters
+  ----------
+  multipolygon:MultiPolygon
+  df:Density Field
+  workers:int
+    Number of processes used for the polygons. -1 uses all cpus.
+  executor:concurrent.futures.Executor,optional
+    User executor for the polygons. The DF is sent with every task.
+  
+  Note
+  ----
+  With workers, the DF is pickled once per process.
+  Results are merged with unionGroups, only polygons with overlapping bounding boxes are unioned.
+  """
+  polygons=list(multipolygon.geoms)
+  n=len(polygons)
+  with getExecutor(workers if n>1 else None,executor,process=True,initializer=initWorker,initargs=(dict(df=df),)) as pool:
+    if pool is None:
+      results=[dsimplify_Polygon(polygon,df,*args,**kwargs) for polygon in polygons]
+    else:
+      _df=df if executor is not None else None
+      results=list(pool.map(_dsimplifyPolygon,polygons,repeat(_df),repeat(args),repeat(kwargs)))
+  return unionGroups(results)
+
+def _dsimplifyTile(polygon,core,df,fine,coarse,kwargs):
+  """
+  Simplify a tile and clip it to its core.
+  fine and coarse are already clipped to the extended tile.
+  """
+  if fine is not None:fine=fine.intersection(polygon)
+  if coarse is not None:coarse=coarse.intersection(polygon)
+  polygons=[polygon] if isinstance(polygon,Polygon) else [p for p in getattr(polygon,'geoms',[]) if isinstance(p,Polygon)]
+  results=[dsimplify_Polygon(p,df,fine=fine,coarse=coarse,**kwargs) for p in polygons if not p.is_empty]
+  return unary_union(results).intersection(core)
+
+def _dsimplifyTiled(polygon,df,tileSize,overlap=None,workers=None,executor=None,stats=None,fine=None,coarse=None,**kwargs):
+  """
+  Tiled dsimplify_Polygon
+  
+  The domain is split in square tiles of tileSize. Every tile is extended by the overlap,
+  simplified with the density points and the fine/coarse data of the extended tile (see DF.subset)
+  and clipped back to the tile. Tiles on the border of the domain are not clipped on the outer side.
+  Tiles are simplified in a process pool and merged with unary_union.
+  Seams are repaired with a small closing (buffer/unbuffer of 0.1*minDensity) and the seam vertices are simplified.
+  
+  Note
+  ----
+  Memory and time depend on the tile size and not on the total length of the domain.
+  Tiles use the steps of the whole domain.
+  With an overlap larger than the distance of influence of the density points on the zones (default),
+  the Hausdorff distance to the untiled result is bounded by the simplify tolerances, 1+2*0.1*minDensity.
+  Holes enclosed by the outer zones (see _getZone) of several tiles are not guaranteed to match.
+  """
+  if overlap is None:overlap=DF.getl_D(df.minDensity,df.minGrowth,df.maxDensity)
+  overlap=float(overlap)
+  # Tiles use the steps of the whole domain
+  if kwargs.get('steps') is None:kwargs['steps']=STEPS[STEPS<polygon.length]
+  minx,miny,maxx,maxy=polygon.bounds
+  nx=max(1,int(np.ceil((maxx-minx)/tileSize)))
+  ny=max(1,int(np.ceil((maxy-miny)/tileSize)))
+  
+  tasks=[]
+  for i in range(nx):
+    for j in range(ny):
+      extent=np.array([minx+i*tileSize,miny+j*tileSize,minx+(i+1)*tileSize,miny+(j+1)*tileSize])
+      if not box(*extent).intersects(polygon):continue
+      # The result can grow outside the domain, border tiles keep it
+      core=extent+overlap*np.array([-(i==0),-(j==0),i==nx-1,j==ny-1])
+      extent=extent+np.array([-overlap,-overlap,overlap,overlap])
+      clip=box(*extent)
+      tile=polygon.intersection(clip)
+      if tile.is_empty:continue
+      _fine=fine.intersection(clip) if fine else None
+      _coarse=coarse.intersection(clip) if coarse else None
+      tasks.append((tile,box(*core),df.subset(extent),_fine,_coarse,kwargs))
+  if stats is not None:stats.update(tiles=len(tasks))
+  
+  with getExecutor(workers if len(tasks)>1 else None,executor,process=True) as pool:
+    if pool is None:results=[_dsimplifyTile(*task) for task in tasks]
+    else:results=list(pool.map(_dsimplifyTile,*zip(*tasks)))
+  
+  eps=df.minDensity*0.1
+  result=unary_union([r for r in results if not r.is_empty])
+  return result.buffer(eps,join_style=2).buffer(-eps,join_style=2).simplify(eps)
+
 def DotProduct(A,B):
   return A[...,0]*B[...,0]+A[...,1]*B[...,1]
 
@@ -189,35 +502,237 @@ def _CrossProduct(A,B):
   return A[...,0]*B[...,1]-A[...,1]*B[...,0]
 
 
-def _inearest_Polygon(p2,p1,angle=90.0,minDistance=0):
-  
-  xy=p1[:,-2:]
+def _coneVectors(V,angle):
+  """
+  Vectors rotated by -angle/2 and +angle/2 (degrees)
+  """
+  rad=np.radians(angle*0.5)
+  c1,s1=np.cos(-rad),np.sin(-rad)
+  c2,s2=np.cos(rad),np.sin(rad)
+  R1=np.column_stack((c1*V[:,0]-s1*V[:,1],s1*V[:,0]+c1*V[:,1]))
+  R2=np.column_stack((c2*V[:,0]-s2*V[:,1],s2*V[:,0]+c2*V[:,1]))
+  return R1,R2
+
+def _coneBuffers(n,buffers=None):
+  """
+  Work buffers of _inearest_Polygon for n neighbours.
+  Existing buffers are reused if they are large enough, memory is about 82*n bytes.
+  """
+  if buffers is not None and len(buffers['targets'])>=n:return buffers
+  return dict(
+    rows=np.empty(n,dtype=np.intp),
+    R1=np.empty((n,2)),
+    R2=np.empty((n,2)),
+    V1=np.empty((n,2)),
+    targets=np.empty(n),
+    cross=np.empty(n),
+    tmp=np.empty(n),
+    inside=np.empty(n,dtype=bool),
+    tmpb=np.empty(n,dtype=bool),
+  )
+
+def _inearest_Polygon(xy,l,offsets,p1,angle=90.0,minDistance=0,buffers=None):
+  """
+  Parameters
+  ----------
+  xy:2D ndarray : [[x,y]]
+    All boundary points
+  l,offsets:1D ndarray
+    CSR neighbours of p1 (see queryCSR)
+  p1:2D ndarray
+    Source points with normal vectors, [...,xn,yn,x,y]
+  buffers:dict,optional
+    Work buffers (see _coneBuffers), reused between chunks
+  
+  Note
+  ----
+  The angle is the same for all points, only the normal vectors are rotated by -angle/2 and +angle/2.
+  A neighbour is inside the cone if it is on the left of the first vector and on the right of the second.
+  Arrays of the neighbour pairs are gathered in the buffers, only arrays of the source points are allocated.
+  """
+  n=len(l)
+  if buffers is None:buffers=_coneBuffers(n)
+  rows=buffers['rows'][:n]
+  R1=buffers['R1'][:n]
+  R2=buffers['R2'][:n]
+  V1=buffers['V1'][:n]
+  targets=buffers['targets'][:n]
+  cross=buffers['cross'][:n]
+  tmp=buffers['tmp'][:n]
+  inside=buffers['inside'][:n]
+  tmpb=buffers['tmpb'][:n]
+  
+  # Row of every neighbour, csrRows without the (n,) temporaries
+  rows.fill(0)
+  starts=offsets[1:-1]
+  np.add.at(rows,starts[starts<n],1)
+  np.cumsum(rows,out=rows)
+  sxy=p1[:,-2:]
   V2=p1[:,-4:-2]
   
+  # Unit vectors from the source points to their neighbours
+  np.take(xy,l,axis=0,out=V1)
+  np.take(sxy,rows,axis=0,out=R1)
+  V1-=R1
+  np.multiply(V1[:,0],V1[:,0],out=targets)
+  np.multiply(V1[:,1],V1[:,1],out=tmp)
+  targets+=tmp
+  np.sqrt(targets,out=targets)
+  V1/=targets[:,None]
+  
+  r1,r2=_coneVectors(V2,angle)
+  np.take(r1,rows,axis=0,out=R1)
+  np.take(r2,rows,axis=0,out=R2)
+  
+  # cross(R1,V1)>=0 and cross(V1,R2)>=0
+  np.multiply(R1[:,0],V1[:,1],out=cross)
+  np.multiply(R1[:,1],V1[:,0],out=tmp)
+  cross-=tmp
+  np.greater_equal(cross,0,out=inside)
+  np.multiply(V1[:,0],R2[:,1],out=cross)
+  np.multiply(V1[:,1],R2[:,0],out=tmp)
+  cross-=tmp
+  np.greater_equal(cross,0,out=tmpb)
+  inside&=tmpb
+  
+  maxValue=np.maximum(1,np.max(targets)) if n else 1
+  np.logical_not(inside,out=inside)
+  np.copyto(targets,maxValue,where=inside)
+  np.less_equal(targets,minDistance,out=inside)
+  np.copyto(targets,maxValue,where=inside)
+  
+  return segmentMin(targets,offsets,maxValue)
+
+def _polygonSegments(polygon):
+  """
+  Boundary segments of a Polygon, [[x0,y0,x1,y1]]. Zero-length segments are removed.
+  """
+  segments=[]
+  for ring in [polygon.exterior,*polygon.interiors]:
+    coords=np.asarray(ring.coords)[:,:2]
+    segments.append(np.column_stack((coords[:-1],coords[1:])))
+  segments=np.concatenate(segments) if segments else np.zeros((0,4))
+  return segments[np.any(segments[:,:2]!=segments[:,2:],axis=1)]
+
+def _clipHalfPlane(f0,f1,lo,hi):
+  """
+  Restrict the parametric interval [lo,hi] of segments to f(t)=f0+t*(f1-f0)>=0
+  """
+  df=f1-f0
+  with np.errstate(divide='ignore',invalid='ignore'):t=-f0/df
+  lo=np.where(df>0,np.maximum(lo,t),lo)
+  hi=np.where(df<0,np.minimum(hi,t),hi)
+  hi=np.where((df==0)&(f0<0),-1.0,hi)
+  return lo,hi
+
+def _inearestSegments(segments,l,offsets,p1,maxDistance,angle=90.0,minDistance=0):
+  """
+  Nearest distance to boundary segments inside the cone of every source point
   
-  rad1=np.zeros(len(V2))- np.radians(angle*0.5)
-  rad2=np.zeros(len(V2))+ np.radians(angle*0.5)
-  
-  V2N=np.column_stack((V2, np.ones(len(V2))))
-  V2R1 = np.einsum('aij,aj->ai', rotate(rad1), V2N)[...,:-1]
-  V2R2 = np.einsum('aij,aj->ai', rotate(rad2), V2N)[...,:-1]
-  
-  
-  V1 = p2 - xy[:,None]
-  targets = np.linalg.norm(V1, axis=2)
-  VV1=V1/targets[:,:,None]
-  indices=(_CrossProduct(V2R1[:,None], VV1) >= 0) & (_CrossProduct(VV1, V2R2[:,None]) >= 0)
-  
-  maxValue=np.maximum(1,np.max(targets))
-  targets[np.invert(indices)]=maxValue
-  targets[targets<=minDistance]=maxValue
-  
-  
-  m=np.min(targets,axis=1)
+  Parameters
+  ----------
+  segments:2D ndarray : [[x0,y0,x1,y1]]
+  l,offsets:1D ndarray
+    CSR candidate segments of p1
+  p1:2D ndarray
+    Source points with normal vectors, [...,xn,yn,x,y]
+  
+  Note
+  ----
+  Segments are clipped to the cone (intersection of two half-planes),
+  the distance is the distance to the nearest point of the clipped segment.
+  Segments incident to the source point are ignored.
+  Points without segment inside the cone and within maxDistance return maxDistance.
+  """
+  rows=csrRows(offsets)
+  sxy=p1[:,-2:]
+  R1,R2=_coneVectors(p1[:,-4:-2],angle)
+  R1,R2,sxy=R1[rows],R2[rows],sxy[rows]
+  
+  a=segments[l,:2]-sxy
+  b=segments[l,2:]-sxy
+  incident=np.all(a==0,axis=1)|np.all(b==0,axis=1)
+  
+  lo=np.zeros(len(l))
+  hi=np.ones(len(l))
+  lo,hi=_clipHalfPlane(_CrossProduct(R1,a),_CrossProduct(R1,b),lo,hi)
+  lo,hi=_clipHalfPlane(_CrossProduct(a,R2),_CrossProduct(b,R2),lo,hi)
+  
+  # Nearest point of the clipped segment to the source point
+  ab=b-a
+  length2=DotProduct(ab,ab)
+  t=np.clip(-DotProduct(a,ab)/length2,lo,hi)
+  p=a+t[:,None]*ab
+  targets=np.sqrt(DotProduct(p,p))
+  
+  targets[(lo>hi)|incident|(targets<=minDistance)|(targets>maxDistance)]=maxDistance
+  return segmentMin(targets,offsets,maxDistance)
+
+def _inearestState(polygon,maxDistance,mode):
+  """
+  Boundary points and search structure of a polygon, shared by the chunks
+  """
+  points=polygon._np(isNorm=True,onPoint=True)
+  state=dict(points=points,mode=mode,maxDistance=maxDistance)
+  if mode=="segment":
+    state['segments']=_polygonSegments(polygon)
+    state['grid']=SegmentGrid(state['segments'],maxDistance)
+  else:
+    state['kdtree']=spatial.cKDTree(points[:,-2:])
+  return state
+
+def _inearestRange(i,start,end,nvalue,kwargs,state=None):
+  """
+  Nearest distances of points start:end of polygon i, by chunks of nvalue points
+  """
+  if state is None:state=workerState('inearest')[i]
+  points=state['points']
+  xy=points[:,-2:]
+  maxDistance=state['maxDistance']
+  inearest=np.zeros(end-start)
+  buffers=None
+  for x in range(start,end,nvalue):
+    xn = np.minimum(end,x+nvalue)
+    subpoints = points[x:xn]
+    if state['mode']=="segment":
+      l,offsets = state['grid'].query(subpoints[:,-2:])
+      inearest[x-start:xn-start]=_inearestSegments(state['segments'],l,offsets,subpoints,maxDistance,**kwargs)
+    else:
+      l,offsets = queryCSR(state['kdtree'],subpoints[:,-2:],maxDistance)
+      buffers=_coneBuffers(len(l),buffers)
+      inearest[x-start:xn-start]=_inearest_Polygon(xy,l,offsets,subpoints,buffers=buffers,**kwargs)
+  return inearest
+
+def _inearestPolygons(polygons,maxDistance=1.0,nvalue=100,progress=False,mode="vertex",workers=None,executor=None,**kwargs):
+  if mode not in ["vertex","segment"]:raise Exception("mode needs to be 'vertex' or 'segment'")
+  states=[_inearestState(polygon,maxDistance,mode) for polygon in polygons]
+  npoints=[len(state['points']) for state in states]
+  
+  # Tasks are ranges of whole chunks, results don't depend on the number of workers
+  n=nworkers(workers) if executor is None else max(1,getattr(executor,'_max_workers',1))
+  nchunks=sum(-(-npoint//nvalue) for npoint in npoints)
+  size=nvalue*max(1,-(-nchunks//(4*n)))
+  tasks=[(i,x,min(npoint,x+size)) for i,npoint in enumerate(npoints) for x in range(0,npoint,size)]
+  
+  if progress:t=tqdm(total=sum(npoints),unit_scale=True)
+  results=[]
+  with getExecutor(workers if len(tasks)>1 else None,executor,process=True,initializer=initWorker,initargs=(dict(inearest=states),)) as pool:
+    if pool is None:
+      iterator=(_inearestRange(i,x,xn,nvalue,kwargs,states[i]) for i,x,xn in tasks)
+    elif executor is None:
+      iterator=pool.map(_inearestRange,*zip(*tasks),repeat(nvalue),repeat(kwargs))
+    else:
+      iterator=pool.map(_inearestRange,*zip(*tasks),repeat(nvalue),repeat(kwargs),[states[i] for i,_,_ in tasks])
+    for (i,x,xn),result in zip(tasks,iterator):
+      results.append(result)
+      if progress:t.update(xn-x)
+  if progress:t.close()
   
-  return m
+  if len(results)==0:return np.zeros((0,3))
+  xy=np.concatenate([state['points'][:,-2:] for state in states])
+  return np.column_stack((xy,np.concatenate(results)))
 
-def inearest_Polygon(polygon,maxDistance=1.0,nvalue=100,progress=False,**kwargs):
+def inearest_Polygon(polygon,*args,**kwargs):
   """
   Computes nearest interior nodes based on its normal and an angle spread.
   The maximum search distance needs to be specified to avoid searching large quantities of points in large domains. 
@@ -236,6 +751,18 @@ def inearest_Polygon(polygon,maxDistance=1.0,nvalue=100,progress=False,**kwargs)
   nvalue:int
     Number of points processed at the same time.
     Default is 1000
+  mode:str
+    "vertex": nearest boundary vertex inside the cone, the boundary needs to be resampled finely
+    "segment": nearest point of the boundary segments inside the cone (see SegmentGrid), no resampling needed
+  workers:int
+    Number of processes for the chunks. -1 uses all cpus.
+  executor:concurrent.futures.Executor,optional
+    User executor for the chunks. The kd-tree is sent with every task.
+  
+  Note
+  ----
+  With workers, the kd-tree (or segment grid) is pickled once per process.
+  Chunks are grouped in ranges of whole chunks, results don't depend on the number of workers.
   
   Output
   ------
@@ -244,25 +771,16 @@ def inearest_Polygon(polygon,maxDistance=1.0,nvalue=100,progress=False,**kwargs)
     n: Number of points in the original object.
     3:x,y,density  
   """
-  points = polygon._np(isNorm=True,onPoint=True)
-  xy=points[:,-2:]
-  
-  kdtree = spatial.cKDTree(xy)
-  npoints = len(points)
-  
-  inearest = np.zeros(npoints) + maxDistance
-  if progress:t=tqdm(total=npoints,unit_scale=True)
-  
-  for x in range(0,npoints,nvalue):
-    xn = np.minimum(npoints,x+nvalue)
-    subpoints = points[x:xn]
-    l = kdtree.query_ball_point(subpoints[:,-2:],maxDistance)
-    l,e=ll2numpy(l)
-    inearest[x:xn]=_inearest_Polygon(xy[l],subpoints,**kwargs)
-    if progress:t.update(xn-x)
-  if progress:t.close()
-  
-  points = np.column_stack((xy,inearest))
+  return _inearestPolygons([polygon],*args,**kwargs)
+
+def inearest_MultiPolygon(multipolygon,*args,**kwargs):
+  """
+  Computes nearest interior nodes of every polygon (see inearest_Polygon).
+  Chunks of all polygons share the same workers.
   
-  return points
-  
\ No newline at end of file
+  Output
+  ------
+  ndarray:2D array
+   shape:(n,3), polygons one after the other
+  """
+  return _inearestPolygons(list(multipolygon.geoms),*args,**kwargs)
@@ -0,0 +1,39 @@
+"""
+Benchmark inearest "segment" mode on the original boundary against resample and "vertex" mode.
+The difference is measured at the original vertices (nearest resampled vertex).
+
+PYTHONPATH=../mshapely/ python3 test/bench_inearest.py
+"""
+import time
+import warnings
+import numpy as np
+from scipy import spatial
+from shapely.geometry import Point,Polygon
+from shapely.geometry.polygon import orient
+import mshapely
+
+def getPolygon(nvertex=2000):
+  t=np.linspace(0,2*np.pi,nvertex,endpoint=False)
+  r=1000+60*np.sin(7*t)+25*np.sin(31*t)
+  holes=[Point(x,y).buffer(rr,16).exterior for x,y,rr in [(300,0,40),(-400,200,25),(0,-500,60)]]
+  # Same orientation as resample, normals point inside the domain
+  return orient(Polygon(np.column_stack((r*np.cos(t),r*np.sin(t))),holes),-1.0)
+
+def bench(polygon,steps,maxDistance=500,angle=90):
+  t=time.time()
+  segment=polygon.inearest(maxDistance=maxDistance,angle=angle,mode="segment")
+  results=[("segment",len(segment),time.time()-t,0.0)]
+  for step in steps:
+    t=time.time()
+    vertex=polygon.resample(step).inearest(maxDistance=maxDistance,angle=angle)
+    dt=time.time()-t
+    _,i=spatial.cKDTree(vertex[:,:2]).query(segment[:,:2])
+    results.append(("vertex({})".format(step),len(vertex),dt,np.median(np.abs(vertex[i,2]-segment[:,2]))))
+  return results
+
+if __name__ == "__main__":
+  warnings.filterwarnings("ignore")
+  print("{:>10}{:>14}{:>10}{:>10}{:>14}".format("nvertex","mode","npoint","time(s)","median diff"))
+  for nvertex in [500,2000]:
+    for mode,npoint,dt,diff in bench(getPolygon(nvertex),[20,5,2]):
+      print("{:>10}{:>14}{:>10}{:>10.3f}{:>14.3f}".format(nvertex,mode,npoint,dt,diff))
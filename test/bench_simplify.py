@@ -0,0 +1,30 @@
+"""
+Benchmark DF simplification engines, "step" vs "dominance", for different growth rates.
+
+PYTHONPATH=../mshapely/ python3 test/bench_simplify.py
+"""
+import time
+import numpy as np
+from mshapely.spatial import DF
+
+def bench(minGrowth,npoint=20000,seed=0):
+  rng=np.random.default_rng(seed)
+  density=np.column_stack((
+    rng.uniform(0,10000,(npoint,2)),
+    rng.uniform(1,100,npoint),
+    np.zeros(npoint)+minGrowth))
+
+  results={}
+  for engine in ["step","dominance"]:
+    t=time.time()
+    df=DF(density.copy(),minDensity=1,maxDensity=100,simplify=engine)
+    results[engine]=(time.time()-t,df.dp)
+
+  assert np.array_equal(results["step"][1],results["dominance"][1])
+  return results["step"][0],results["dominance"][0],len(results["dominance"][1])
+
+if __name__ == "__main__":
+  print("{:>10}{:>10}{:>12}{:>12}{:>10}".format("minGrowth","npoint","step(s)","dominance(s)","speedup"))
+  for minGrowth in [1.01,1.02,1.05,1.1,1.2,1.5]:
+    step,dominance,npoint=bench(minGrowth)
+    print("{:>10}{:>10}{:>12.3f}{:>12.3f}{:>10.1f}".format(minGrowth,npoint,step,dominance,step/dominance))
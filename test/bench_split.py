@@ -0,0 +1,40 @@
+"""
+Benchmark MultiPoint splitting of a LineString (dresample_LineString with mp=).
+The point-by-point splitting is only timed on the small case.
+
+PYTHONPATH=../mshapely/ python3 test/bench_split.py
+"""
+import time
+import numpy as np
+from shapely.geometry import LineString,MultiPoint
+from mshapely.spatial.resample import _split_line_with_point,_split_line_with_multipoint
+
+def split_pointbypoint(line,splitter):
+  chunks=[line]
+  for pt in splitter.geoms:
+    new_chunks=[]
+    for chunk in chunks:new_chunks.extend(_split_line_with_point(chunk,pt))
+    chunks=new_chunks
+  return chunks
+
+def bench(nvertex,npoint,pointbypoint=False,seed=0):
+  rng=np.random.default_rng(seed)
+  xy=np.round(np.cumsum(rng.uniform(-1,1,(nvertex,2)),axis=0),6)
+  line=LineString(xy)
+  mp=MultiPoint(xy[np.sort(rng.choice(np.arange(1,nvertex-1),npoint,replace=False))])
+  
+  t=time.time()
+  chunks=_split_line_with_multipoint(line,mp)
+  results=[time.time()-t,np.nan]
+  if pointbypoint:
+    t=time.time()
+    _chunks=split_pointbypoint(line,mp)
+    results[1]=time.time()-t
+    assert len(chunks)==len(_chunks)
+  return results,len(chunks)
+
+if __name__ == "__main__":
+  print("{:>10}{:>10}{:>10}{:>14}{:>16}".format("nvertex","npoint","nchunk","sortonce(s)","pointbypoint(s)"))
+  for nvertex,npoint,pointbypoint in [(10000,100,True),(1000000,10000,False)]:
+    (sortonce,_pointbypoint),nchunk=bench(nvertex,npoint,pointbypoint)
+    print("{:>10}{:>10}{:>10}{:>14.3f}{:>16.3f}".format(nvertex,npoint,nchunk,sortonce,_pointbypoint))
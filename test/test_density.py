@@ -1,11 +1,14 @@
 
 import pytest
 import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 
 import mshapely
 from mshapely.spatial import DF
+from mshapely.misc import ll2csr,segmentMin,segmentArgmin
 
 
 def test_DF_static():
@@ -28,20 +31,136 @@ def test_DF_static():
 def test_ll2numpy():
   None
 
+def test_ll2csr():
+  l,offsets=ll2csr([[0,1],[],[2,3,4]])
+  np.testing.assert_array_equal(l,[0,1,2,3,4])
+  np.testing.assert_array_equal(offsets,[0,2,2,5])
+  
+  values=np.array([3.,1.,5.,2.,2.])
+  np.testing.assert_array_equal(segmentMin(values,offsets,-1),[1,-1,2])
+  np.testing.assert_array_equal(segmentArgmin(values,offsets),[1,-1,3])
+
 def test_simplify():
   density=np.array([[0,0,1,1.2],[2.5,0,10,1.2],[5,0,1,1.05]])
   df=DF(density,minDensity=1,maxDensity=100,minGrowth=1.2)
   np.testing.assert_array_equal(df.dp,[[0,0,1,1.2,0,0],[5,0,1,1.05,0,2]])
   
+def test_simplifyEngine():
+  rng=np.random.default_rng(0)
+  for growth in [1.02,1.2]:
+    density=np.column_stack((rng.uniform(0,1000,(2000,2)),rng.uniform(1,50,2000),np.zeros(2000)+growth))
+    df=DF(density.copy(),minDensity=1,maxDensity=50)
+    df1=DF(density.copy(),minDensity=1,maxDensity=50,simplify="step")
+    np.testing.assert_array_equal(df.dp,df1.dp)
+  
+def test_add():
+  rng=np.random.default_rng(0)
+  groups=[np.column_stack((rng.uniform(0,500,(500,2)),rng.uniform(1,20,500),np.zeros(500)+1.2)) for i in range(3)]
+  df=DF(groups[0].copy(),minDensity=1,maxDensity=20)
+  df1=DF(groups[0].copy(),minDensity=1,maxDensity=20)
+  for group in groups[1:]:
+    df.add(group.copy())
+    df1.add(group.copy(),incremental=False)
+  
+  # Same points, different order
+  np.testing.assert_array_equal(np.unique(df.dp,axis=0),np.unique(df1.dp,axis=0))
+  tp=rng.uniform(0,500,(1000,2))
+  np.testing.assert_array_equal(df.getDensity(tp),df1.getDensity(tp))
+  
+  # Existing field without points
+  df2=df.subset([1000,1000,1100,1100]).add(np.array([[150,150,2,1.2]]))
+  np.testing.assert_array_equal(df2.dp[:,:4],[[150,150,2,1.2]])
+  np.testing.assert_array_equal(df2.getDensity([[150,150]]),[2])
+  
 def test_getDensity():
   density=np.array([[0,0,1,1.2],[2.5,0,10,1.2],[5,0,1,1.2]])
   df=DF(density,minDensity=1,maxDensity=100,minGrowth=1.2)
   np.testing.assert_array_equal(df.getDensity([[2.2,0]]),[1.44])
   
+def test_workers():
+  rng=np.random.default_rng(0)
+  density=np.column_stack((rng.uniform(0,100,(200,2)),rng.uniform(1,10,200),np.zeros(200)+1.2))
+  df=DF(density,minDensity=1,maxDensity=10,nvalue=100)
+  tp=rng.uniform(0,100,(1000,2))
+  results=df.getDensity(tp)
+  df.workers=2
+  np.testing.assert_array_equal(df.getDensity(tp),results)
+  
+  # The thread pool is created once
+  pool=df._pool
+  assert pool is not None
+  np.testing.assert_array_equal(df.getDensity(tp),results)
+  assert df._pool is pool
+  assert pickle.loads(pickle.dumps(df))._pool is None
+  df.close()
+  assert df._pool is None
+  
+  # Process executor
+  with ProcessPoolExecutor(2) as executor:
+    df.executor=executor
+    np.testing.assert_array_equal(df.getDensity(tp),results)
+    np.testing.assert_array_equal(df.getDensity(tp[:,:2],dp=df.dp,return_index=True,radius=5.0),
+      DF(density,minDensity=1,maxDensity=10,nvalue=100).getDensity(tp[:,:2],dp=df.dp,return_index=True,radius=5.0))
+  
+def test_densityAt():
+  rng=np.random.default_rng(0)
+  density=np.column_stack((rng.uniform(0,100,(200,2)),rng.uniform(1,10,200),np.zeros(200)+1.2))
+  df=DF(density,minDensity=1,maxDensity=10)
+  tp=rng.uniform(-10,110,(100,2))
+  np.testing.assert_almost_equal([df.densityAt(x,y) for x,y in tp],df.getDensity(tp))
+  
+  window=df.densityWindow(50,50,30)
+  tp1=tp[np.hypot(tp[:,0]-50,tp[:,1]-50)<=30]
+  np.testing.assert_array_equal([window(x,y) for x,y in tp1],[df.densityAt(x,y) for x,y in tp1])
+  
+  df.setCache(1000,cacheResolution=0.5)
+  tp=np.round(tp*2)*0.5
+  for i in range(3):
+    np.testing.assert_almost_equal([df.densityAt(x,y) for x,y in tp],df.getDensity(tp))
+  info=df.cacheInfo()
+  assert info.misses==100 and info.hits==200
+  
+def test_npz():
+  path="./test/data/test_density.npz"
+  rng=np.random.default_rng(0)
+  density=np.column_stack((rng.uniform(0,100,(200,2)),rng.uniform(1,10,200),np.zeros(200)+1.2))
+  df=DF(density,minDensity=1,maxDensity=10)
+  tp=rng.uniform(0,100,(1000,2))
+  for kdtree in [False,True]:
+    df.write(path,kdtree=kdtree)
+    df1=DF.read(path)
+    np.testing.assert_array_equal(df1.dp,df.dp)
+    np.testing.assert_array_equal([df1.minDensity,df1.maxDensity,df1.minGrowth],[df.minDensity,df.maxDensity,df.minGrowth])
+    np.testing.assert_array_equal(df1.getDensity(tp),df.getDensity(tp))
+  del df1
+  os.remove(path)
+  
+def test_toGrid():
+  density=np.array([[0,0,1,1.2],[2.5,0,10,1.2],[5,0,1,1.2],[20,10,2,1.1]])
+  df=DF(density,minDensity=1,maxDensity=100,minGrowth=1.1)
+  tp=np.random.default_rng(0).uniform(-5,25,(1000,2))
+  exact=df.getDensity(tp)
+  df.toGrid([0,0,20,10],0.5)
+  results=df.getDensity(tp)
+  assert np.max(np.abs(results-exact))<=df.gridError
+  
+  # Outside the grid, it uses the exact field
+  df.useGrid=False
+  outside=df.getDensity([[-5,-5],[25,15]])
+  df.useGrid=True
+  np.testing.assert_array_equal(df.getDensity([[-5,-5],[25,15]]),outside)
+  
 
 if __name__ == "__main__":
   test_DF_static()
+  test_ll2csr()
   test_simplify()
+  test_simplifyEngine()
+  test_add()
   test_getDensity()
+  test_workers()
+  test_densityAt()
+  test_npz()
+  test_toGrid()
   
 
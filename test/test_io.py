@@ -28,6 +28,139 @@ def test_tofile():
   point.delete(path_p_shp)
   polygon.delete(path_pol_shp)
   
+def test_iter():
+  points=GeometryCollection([Point(i,i*2) for i in range(5)])
+  schema={'geometry':'Point','properties':{'id':'int:10'}}
+  for path in ["./test/data/test_iter.geojson","./test/data/test_iter.shp","./test/data/test_iter.mshp"]:
+    GIS(points,schema=schema).write(path)
+    batches=list(GIS.iter(path,chunkSize=2))
+    assert [len(geometries) for geometries,properties in batches]==[2,2,1]
+    geometries=[g for geometries,properties in batches for g in geometries]
+    properties=[p for geometries,properties in batches for p in properties]
+    assert all(g.equals(p) for g,p in zip(geometries,points.geoms))
+    assert [p['id'] for p in properties]==list(range(5))
+    
+    gis=GIS.read(path)
+    assert len(gis.geometry.geoms)==5 and gis.schema['geometry']=='Point'
+    GIS.delete(path)
+  
+  with pytest.raises(Exception):GIS.iter("./test/data/none.geojson")
+  
+def test_filter():
+  squares=GeometryCollection([Polygon([(x,0),(x+1,0),(x+1,1),(x,1)]) for x in range(0,50,10)])
+  schema={'geometry':'Polygon','properties':{'id':'int:10'}}
+  for path in ["./test/data/test_filter.geojson","./test/data/test_filter.shp","./test/data/test_filter.mshp"]:
+    GIS(squares,schema=schema).write(path)
+    ids=lambda gis:[p['id'] for p in gis.properties]
+    assert ids(GIS.read(path,bbox=(5,-1,25,2)))==[1,2]
+    assert ids(GIS.read(path,mask=Polygon([(0.5,0.5),(30.5,0.5),(30.5,0.6)])))==[0,1,2,3]
+    assert list(GIS.iter(path,mask=Point(35.5,0.5).buffer(1)))==[]
+    with pytest.raises(Exception):GIS.read(path,mask=Point(35.5,0.5).buffer(1))
+    assert ids(GIS.read(path,where={'id':[0,4]}))==[0,4]
+    assert ids(GIS.read(path,bbox=(-1,-1,100,2),where=lambda p:p['id']>2))==[3,4]
+    batches=list(GIS.iter(path,chunkSize=1,bbox=(5,-1,25,2)))
+    assert len(batches)==2 and batches[0][0][0].equals(squares.geoms[1])
+    with pytest.raises(Exception):GIS.read(path,bbox=(0,0,1,1),mask=Point(0,0))
+    GIS.delete(path)
+  
+  GIS(squares,schema=schema).write("./test/data/test_filter.shp")
+  assert len(GIS.read("./test/data/test_filter.shp",where="id >= 3").properties)==2
+  GIS.delete("./test/data/test_filter.shp")
+  
+def test_write():
+  import gzip,json
+  points=GeometryCollection([Point(i+0.123456789,i) for i in range(25)])
+  schema={'geometry':'Point','properties':{'id':'int:10'}}
+  gis=GIS(points,schema=schema)
+  
+  path="./test/data/test_write.geojson.gz"
+  gis.write(path)
+  with gzip.open(path,'rt') as f:collection=json.load(f)
+  assert len(collection['features'])==25 and collection['schema']==schema
+  assert collection['features'][1]['geometry']['coordinates']==[1.123457,1.0]
+  assert [p['id'] for p in GIS.read(path).properties]==list(range(25))
+  GIS.delete(path)
+  assert not os.path.exists(path)
+  
+  path="./test/data/test_write.geojson"
+  gis.writeGeoJSON(path,precision=None,chunkSize=10)
+  with open(path) as f:collection=json.load(f)
+  assert collection['features'][1]['geometry']['coordinates']==[1.123456789,1.0]
+  assert len(collection['features'])==25
+  GIS.delete(path)
+  
+  path="./test/data/test_write.shp"
+  gis.writeShapefile(path,chunkSize=10)
+  assert len(GIS.read(path).properties)==25
+  GIS.delete(path)
+  
+  # Writer options from the geometry
+  path="./test/data/test_write.geojson"
+  points.write(path,schema=schema,precision=2,chunkSize=10)
+  with open(path) as f:collection=json.load(f)
+  assert collection['features'][1]['geometry']['coordinates']==[1.12,1.0]
+  assert len(collection['features'])==25 and collection['schema']==schema
+  GIS.delete(path)
+  
+def test_columnar():
+  from mshapely.io import ColumnarGeometry
+  path="./test/data/test_columnar.mshp"
+  polygon=Polygon([(0,0),(10,0),(10,10),(0,10)],[[(1,1),(2,1),(2,2)],[(5,5),(6,5),(6,6)]])
+  collections=[
+    GeometryCollection([Point(i,i*2) for i in range(5)]),
+    GeometryCollection([LineString([(0,0),(1,1),(2,0)]),LineString([(0,0),(1,0),(1,1),(0,0)])]),
+    GeometryCollection([LineString([(0,0),(1,1),(2,0)])]),
+    GeometryCollection([polygon]),
+    GeometryCollection([MultiPolygon([polygon]),MultiPolygon([Point(30,0).buffer(3,4).difference(Point(30,0).buffer(1,4)),Point(50,50).buffer(1,2)])]),
+  ]
+  for collection in collections:
+    GIS(collection).write(path)
+    gis=GIS.read(path)
+    assert isinstance(gis.geometry,ColumnarGeometry) and isinstance(gis.geometry.xy,np.memmap)
+    np.testing.assert_array_equal(gis.geometry.np,collection.np)
+    np.testing.assert_array_equal(gis.geometry.xy,collection.xy)
+    assert all(a.equals(b) for a,b in zip(gis.geometry.geoms,collection.geoms))
+    assert gis.geometry.toShape().equals(collection.toShape())
+    assert [p['id'] for p in gis.properties]==list(range(len(collection.geoms)))
+  
+  properties=[dict(name="a",value=1.5,count=1,flag=True),dict(name="bb",value=None,count=2,flag=False)]
+  schema={'geometry':'Point','properties':{'name':'str','value':'float','count':'int','flag':'bool'}}
+  GIS(GeometryCollection([Point(0,0),Point(1,1)]),properties,schema).write(path)
+  gis=GIS.read(path)
+  assert list(gis.properties)==properties and gis.schema==schema
+  assert gis.properties.column('name').dtype.kind=='U'
+  
+  # Density field
+  from mshapely.spatial import DF
+  df=DF(np.array([[0.,0.,1.,1.2],[10.,0.,2.,1.2]]),minDensity=1,maxDensity=10)
+  df.write(path)
+  np.testing.assert_array_equal(DF.read(path).dp[:,:4],df.dp[:,:4])
+  GIS.delete(path)
+  assert not os.path.exists(path)
+  
+def test_readMany():
+  schema={'geometry':'Polygon','properties':{'id':'int:10'}}
+  paths=["./test/data/test_readMany.{}".format(ext) for ext in ["shp","geojson","mshp"]]
+  for k,path in enumerate(paths):
+    tile=GeometryCollection([Point(k*10+i,0).buffer(1,4) for i in range(5)])
+    properties=[dict(id=i,tile=k) for i in range(5)] if k==1 else None
+    GIS(tile,properties,schema).write(path)
+  tiles=[g for path in paths for g in GIS.read(path).geometry.geoms]
+  
+  for workers in [None,2]:
+    gis=GIS.readMany(paths,workers=workers)
+    assert len(gis.geometry)==15 and all(a.equals(b) for a,b in zip(gis.geometry.geoms,tiles))
+    assert [p['source'] for p in gis.properties]==[path for path in paths for i in range(5)]
+    assert [p['id'] for p in gis.properties]==list(range(5))*3
+    assert [p['tile'] for p in gis.properties]==[None]*5+[1]*5+[None]*5
+    np.testing.assert_array_equal(gis.geometry.xy,np.concatenate([GIS.read(path).geometry.xy for path in paths]))
+  
+  gis=GIS.readMany(paths,source=None,bbox=(-1,-1,0.5,1))
+  assert len(gis.geometry)==2 and 'source' not in gis.properties[0]
+  assert len(GIS.readMany(paths,mask=Point(-0.5,0).buffer(0.2)).geometry)==1
+  with pytest.raises(Exception):GIS.readMany(paths+["./test/data/none.shp"])
+  for path in paths:GIS.delete(path)
+  
 def test_tonumpy():
   point = Point(10,10)
   line = LineString([(0, 0), (0, 1),(1,1),(1,0),(0,0)])
@@ -105,6 +238,11 @@ def test_tonumpy():
 
 if __name__ == "__main__":
   test_tofile()
+  test_iter()
+  test_filter()
+  test_write()
+  test_columnar()
+  test_readMany()
   test_tonumpy()
 
   
\ No newline at end of file
@@ -4,6 +4,7 @@ import numpy as np
 from numpy.testing import assert_array_equal
 from shapely.geometry import mapping, shape, Point, LineString, Polygon,MultiPoint,MultiLineString,MultiPolygon,GeometryCollection
 import time
+from shapely.ops import cascaded_union
 
 import mshapely
 from mshapely.spatial import DF
@@ -29,6 +30,11 @@ def test_resample():
    ]))
 
 
+  # Same points as LineString.interpolate
+  line = LineString([(0,0),(3.3,1.7),(3.3,1.7),(10.1,-4.2),(12,7)])
+  r = line.resample(0.7)
+  np.testing.assert_array_equal(r.xy[1:],np.array([line.interpolate(line.length/len(r.xy[1:])*(i+1)).coords[0] for i in range(len(r.xy[1:]))]))
+
 def test_removeHoles():
   polygon = Polygon([(0, 0), (0, 1),(1,1),(1,0),(0,0)])
   polygon2 = Polygon([(0, 0), (0, 1),(1,1),(1,0),(0,0)],[LineString([(0.25, 0.25),(0.75,0.25) ,(0.75,0.75),(0.25, 0.75),(0.25,0.25)])])
@@ -58,6 +64,201 @@ def test_dsimplify():
   a=a.dp[:,:4]
   np.testing.assert_array_equal(a,np.column_stack((np.arange(0,value,100),np.zeros(int(value*0.01)),np.zeros(int(value*0.01))+1.0,np.zeros(int(value*0.01))+1.2)))
 
+def test_dsimplify_workers():
+  polygon=Polygon([(0,0),(100,0),(100,100),(0,100)],[Point(50,50).buffer(5,8).exterior.coords[::-1]]).resample(1)
+  density=np.array([[0,0,1,1.2],[100,0,2,1.2],[100,100,3,1.2],[0,100,2,1.2],[50,45,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  r=polygon.dsimplify(df)
+  np.testing.assert_almost_equal(r.area,10097.393061785793)
+  assert len(r.interiors)==1
+  assert r.equals_exact(polygon.dsimplify(df,workers=2),0)
+
+def test_dsimplify_levels():
+  from mshapely.spatial import densityLevels
+  density=np.array([1,1.2,1.44,1.3,5,10,1.2**5,9.99])
+  np.testing.assert_almost_equal(densityLevels(density,"growth",1,1.2),[1,1.2,1.44,1.2,1.2**8,1.2**12,1.2**5,1.2**12])
+  np.testing.assert_almost_equal(densityLevels(density,3),[1,1,1,1,10**0.5,10,1,10**0.5])
+  np.testing.assert_array_equal(densityLevels(density,1),np.ones(8))
+  assert np.all(densityLevels(density,"growth",1,1.2)<=density)
+  
+  polygon=Polygon([(0,0),(100,0),(100,100),(0,100)],[Point(50,50).buffer(5,8).exterior.coords[::-1]]).resample(1)
+  density=np.array([[0,0,1,1.2],[100,0,2,1.2],[100,100,3,1.2],[0,100,2,1.2],[50,45,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  stats={}
+  r=polygon.dsimplify(df,levels=2,stats=stats)
+  assert stats==dict(zones=2,merged=1)
+  assert len(r.interiors)==1
+
+def test_dsimplify_steps():
+  polygon=Polygon([(0,0),(100,0),(100,100),(0,100)],[Point(50,50).buffer(5,8).exterior.coords[::-1]]).resample(1)
+  density=np.array([[0,0,1,1.2],[100,0,2,1.2],[100,100,3,1.2],[0,100,2,1.2],[50,45,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  r=polygon.dsimplify(df)
+  
+  # Points out of reach don't change the result
+  steps=[]
+  r1=polygon.dsimplify(DF(np.vstack((density,[[3000,3000,1.5,1.2]])),minDensity=1,maxDensity=10),stepStats=steps)
+  assert r.equals_exact(r1,0)
+  assert len(steps)>1 and all(step['unreached']==1 and step['created']==3 and not step['skipped'] for step in steps)
+  assert all(step['time']>=0 for step in steps)
+  
+  # Steps without any zone in reach are skipped
+  steps=[]
+  polygon.dsimplify(DF(np.array([[0,400,1,1.2],[0,420,2,1.2]]),minDensity=1,maxDensity=10),stepStats=steps)
+  assert [step['skipped'] for step in steps]==[False]+[True]*(len(steps)-2)+[False]
+  
+  # Grown zones, saturated zones are reused and unchanged steps skipped
+  steps=[]
+  r2=polygon.dsimplify(df,grow=True,stepStats=steps)
+  assert steps[0]['created']==3 and steps[1]['grown']==3
+  assert steps[-1]['reused']==3 and steps[-1]['skipped']
+  assert len(r2.interiors)==1 and abs(r2.area-r.area)<0.002*r.area
+  
+def test_dsimplify_tiled():
+  polygon=Polygon([(0,0),(100,0),(100,100),(0,100)],[Point(50,50).buffer(5,8).exterior.coords[::-1]]).resample(1)
+  density=np.array([[0,0,1,1.2],[100,0,2,1.2],[100,100,3,1.2],[0,100,2,1.2],[50,45,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  r=polygon.dsimplify(df)
+  stats={}
+  r1=polygon.dsimplify(df,tileSize=60,stats=stats)
+  assert stats==dict(tiles=4)
+  assert r1.geom_type=="Polygon" and r1.is_valid and len(r1.interiors)==1
+  assert r1.equals_exact(polygon.dsimplify(df,tileSize=60,workers=2),0)
+  
+  # With an overlap larger than the influence distance, tiles only differ by the simplify tolerances
+  bound=1+2*0.1*df.minDensity
+  overlap=DF.getl_D(df.minDensity,df.minGrowth,df.maxDensity)
+  assert r.hausdorff_distance(r1)<bound
+  for tileSize in [30,40]:
+    r2=polygon.dsimplify(df,tileSize=tileSize,tileOverlap=overlap)
+    assert r2.geom_type=="Polygon" and len(r2.interiors)==1
+    assert r.hausdorff_distance(r2)<bound
+  
+  # fine and coarse are clipped to the tiles
+  r3=polygon.dsimplify(df,tileSize=40,fine=polygon,coarse=polygon)
+  assert r.hausdorff_distance(r3)<bound
+
+def test_dsimplify_multipolygon():
+  from mshapely.spatial import unionGroups
+  squares=[Polygon([(x,y),(x+10,y),(x+10,y+10),(x,y+10)]) for x,y in [(0,0),(5,5),(30,0),(60,0),(65,0)]]
+  r=unionGroups(squares)
+  assert r.geom_type=="MultiPolygon" and len(r.geoms)==3
+  assert r.equals(cascaded_union(squares))
+  assert unionGroups(squares[:1]).equals(squares[0])
+  assert unionGroups([]).is_empty
+  
+  multipolygon=MultiPolygon([Polygon([(x,0),(x+50,0),(x+50,50),(x,50)]).resample(1) for x in [0,100]])
+  density=np.array([[0,0,1,1.2],[50,50,2,1.2],[100,0,2,1.2],[150,50,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  r=multipolygon.dsimplify(df)
+  assert r.geom_type=="MultiPolygon" and len(r.geoms)==2
+  assert r.equals(cascaded_union([polygon.dsimplify(df) for polygon in multipolygon.geoms]))
+  assert r.equals_exact(multipolygon.dsimplify(df,workers=2),0)
+
+def test_dsimplify_raster():
+  from mshapely.spatial.raster import rasterize,polygonize
+  square=Polygon([(2,2),(8,2),(8,8),(2,8)],[[(4,4),(4,6),(6,6),(6,4)]])
+  mask=rasterize(square,0,0,1,(10,10))
+  assert np.sum(mask)==32
+  assert polygonize(mask,0,0,1).equals(square)
+  assert polygonize(np.zeros((3,3),dtype=bool),0,0,1).is_empty
+  
+  polygon=Polygon([(0,0),(100,0),(100,100),(0,100)],[Point(50,50).buffer(5,8).exterior.coords[::-1]]).resample(1)
+  density=np.array([[0,0,1,1.2],[100,0,2,1.2],[100,100,3,1.2],[0,100,2,1.2],[50,45,1,1.2]])
+  df=DF(density,minDensity=1,maxDensity=10)
+  r=polygon.dsimplify(df,levels="growth")
+  stats={}
+  r1=polygon.dsimplify(df,engine="raster",stats=stats)
+  assert stats['raster']==(106,106)
+  assert r1.geom_type=="Polygon" and r1.is_valid and len(r1.interiors)==1
+  assert r.symmetric_difference(r1).area<0.03*r.area
+  
+  # Error bound of the raster engine, relative to a fine raster
+  ref=polygon.dsimplify(df,engine="raster",resolution=0.125)
+  for resolution in [0.25,0.5,1.0,2.0]:
+    r2=polygon.dsimplify(df,engine="raster",resolution=resolution)
+    assert ref.hausdorff_distance(r2)<=2*np.sqrt(2)*(resolution+0.125)
+  # The vector engine simplifies the domain by 1 at every step
+  assert r.hausdorff_distance(ref)<2
+  with pytest.raises(Exception):polygon.dsimplify(df,engine="pixel")
+
+def test_inearest_chunks():
+  from scipy import spatial
+  from mshapely.spatial.spatial import _coneBuffers,_inearest_Polygon
+  from mshapely.misc import queryCSR
+  polygon=Polygon(Point((0,0)).buffer(100).exterior,[Point((-50,0)).buffer(20).exterior.coords[::-1]])
+  density=polygon.inearest(maxDistance=100,angle=90,nvalue=7)
+  assert np.all(density[:,2]<=100) and np.any(density[:,2]<50)
+  
+  points=polygon._np(isNorm=True,onPoint=True)
+  xy=points[:,-2:]
+  l,offsets=queryCSR(spatial.cKDTree(xy),xy[:20],100)
+  buffers=_coneBuffers(len(l)+100)
+  for key in buffers:buffers[key].fill(1)
+  assert_array_equal(_inearest_Polygon(xy,l,offsets,points[:20],buffers=buffers),_inearest_Polygon(xy,l,offsets,points[:20]))
+  assert _coneBuffers(len(l),buffers) is buffers
+  assert len(_coneBuffers(len(l)+101,buffers)['targets'])==len(l)+101
+  
+  # Rows without neighbours
+  r=_inearest_Polygon(xy,l,offsets,points[:20])
+  _offsets=np.concatenate(([0],offsets[:2],offsets[1:],offsets[-1:]))
+  _points=np.concatenate((points[:1],points[:1],points[:20],points[:1]))
+  _r=_inearest_Polygon(xy,l,_offsets,_points,buffers=buffers)
+  assert_array_equal(_r[[1]+list(range(3,22))],r)
+  assert np.all(_r[[0,2,22]]>=r.max())
+
+def test_inearest_segment():
+  from mshapely.misc import SegmentGrid
+  segments=np.array([[0,0,10,0],[10,0,10,10],[0,25,30,25]])
+  l,offsets=SegmentGrid(segments,5).query([[1,1],[28,24],[100,100]])
+  assert_array_equal(np.unique(l[offsets[0]:offsets[1]]),[0])
+  assert_array_equal(np.unique(l[offsets[1]:offsets[2]]),[2])
+  assert offsets[2]==offsets[3]
+  
+  # Long diagonal segment, only the crossed cells are stored
+  grid=SegmentGrid([[0,0,5000,5000]],0.1)
+  assert len(grid.keys)<=3*50000+1
+  l,offsets=grid.query([[2500.05,2500.1],[2500,2600]])
+  assert_array_equal(np.diff(offsets)>0,[True,False])
+  
+  # Same segments as a brute-force distance search
+  rng=np.random.default_rng(0)
+  segments=rng.random((200,4))*100
+  points=rng.random((500,2))*100
+  a,d=segments[:,:2],segments[:,2:]-segments[:,:2]
+  t=np.clip(np.sum((points[:,None]-a)*d,axis=-1)/np.sum(d*d,axis=-1),0,1)
+  distance=np.linalg.norm(points[:,None]-(a+t[...,None]*d),axis=-1)
+  l,offsets=SegmentGrid(segments,3).query(points)
+  for i in range(len(points)):
+    assert set(np.where(distance[i]<=3)[0])<=set(l[offsets[i]:offsets[i+1]])
+  
+  polygon=Polygon([(0,0),(0,10),(100,10),(100,0)])
+  density=polygon.inearest(maxDistance=50,angle=90,mode="segment")
+  assert_array_equal(density[:,:2],polygon.exterior.coords)
+  np.testing.assert_almost_equal(density[:,2],10)
+  density=polygon.inearest(maxDistance=5,angle=90,mode="segment")
+  np.testing.assert_almost_equal(density[:,2],5)
+  
+  dense=polygon.resample(1).inearest(maxDistance=50,angle=90)
+  np.testing.assert_almost_equal(np.median(dense[:,2]),10)
+  with pytest.raises(Exception):polygon.inearest(mode="edge")
+
+def test_inearest_workers():
+  from concurrent.futures import ThreadPoolExecutor
+  polygon=Polygon(Point((0,0)).buffer(100).exterior,[Point((-50,0)).buffer(20).exterior.coords[::-1]])
+  density=polygon.inearest(maxDistance=100,angle=90,nvalue=10)
+  assert_array_equal(density,polygon.inearest(maxDistance=100,angle=90,nvalue=10,workers=2))
+  with ThreadPoolExecutor(2) as executor:
+    assert_array_equal(density,polygon.inearest(maxDistance=100,angle=90,nvalue=10,executor=executor))
+  
+  # Ragged MultiPolygon
+  square=Polygon([(200,0),(200,10),(300,10),(300,0)])
+  multipolygon=MultiPolygon([polygon,square])
+  density=multipolygon.inearest(maxDistance=100,angle=90,nvalue=10)
+  assert density.shape==(len(polygon.inearest(maxDistance=100))+5,3)
+  assert_array_equal(density[-5:],square.inearest(maxDistance=100,angle=90))
+  assert_array_equal(density,multipolygon.inearest(maxDistance=100,angle=90,nvalue=10,workers=2))
+
 def test_inearest_dresample():
   import matplotlib.pyplot as plt
   polygon = Point((0,0)).buffer(100)#.simplify(0.1)
@@ -108,6 +309,44 @@ def test_dresample():
   df = DF(density,minDensity=2.0,maxDensity=100.0)
   r = line.dresample(df,mp=mp)
   
+def test_split_multipoint():
+  from mshapely.spatial.resample import _split_line_with_point,_split_line_with_multipoint
+  rng=np.random.default_rng(0)
+  xy=np.round(np.cumsum(rng.uniform(-1,1,(300,2)),axis=0),6)
+  # Long closing segment (i.e. open boundary)
+  closed=np.vstack((xy,xy[0]+[5000,0],xy[0]))
+  lines=[LineString(xy),LineString(xy),LineString([(0,0),(200,0)]),LineString([(0,0),(10,0),(10,10),(0,10),(0,0)]),LineString(closed)]
+  mps=[
+    MultiPoint(xy[rng.choice(300,40)]),
+    MultiPoint([xy[0],xy[-1],xy[10],xy[10]]),
+    MultiPoint([(100,0),(50,0),(300,0),(50,1)]),
+    MultiPoint([(0,0),(0,5),(3.3,0),(10,7.1)]),
+    MultiPoint(np.vstack((xy[rng.choice(300,40)],xy[0]+[2500,0]))),
+  ]
+  for line,mp in zip(lines,mps):
+    chunks=[line]
+    for pt in mp.geoms:
+      chunks=[c for chunk in chunks for c in _split_line_with_point(chunk,pt)]
+    _chunks=_split_line_with_multipoint(line,mp)
+    assert len(chunks)==len(_chunks)
+    for chunk,_chunk in zip(chunks,_chunks):
+      assert chunk.equals_exact(_chunk,1e-9)
+  
+def test_dresample_workers():
+  polygon = Point((0,0)).buffer(100)
+  hole1 = Point((-50,0)).buffer(20)
+  hole2 = Point((50,0)).buffer(20)
+  hole3 = Point((0,50)).buffer(0.3)
+  polygon = Polygon(polygon.exterior,[hole1.exterior.coords[::-1],hole2.exterior.coords[::-1],hole3.exterior.coords[::-1]])
+  multipolygon = MultiPolygon([polygon]+[Point((300+i*30,0)).buffer(10) for i in range(5)])
+  df = DF(np.array([[0,0,1,1.2],[300,0,1,1.1]]),minDensity=1,maxDensity=10)
+  
+  for geometry in [polygon,multipolygon]:
+    r=geometry.dresample(df)
+    r1=geometry.dresample(df,workers=2)
+    assert r.equals_exact(r1,0)
+  assert len(polygon.dresample(df,workers=2).interiors)==2
+  
 def segmentLength():
   line = LineString([(0,0),(200,0),(200,0),(200,0),(200,0)])
   
@@ -116,7 +355,18 @@ if __name__ == "__main__":
   test_resample()
   test_removeHoles()
   test_dsimplify()
+  test_dsimplify_workers()
+  test_dsimplify_levels()
+  test_dsimplify_steps()
+  test_dsimplify_tiled()
+  test_dsimplify_multipolygon()
+  test_dsimplify_raster()
+  test_inearest_chunks()
+  test_inearest_segment()
+  test_inearest_workers()
   test_inearest_dresample()
   test_dresample()
+  test_split_multipoint()
+  test_dresample_workers()
   
   
\ No newline at end of file